@@ -1,6 +1,11 @@
+import time
+
 # TODO: wrap this inside of a django specific class
 from django.contrib.auth.models import AnonymousUser
 
+# Intra-app dependencies.
+from djangocore.api.utils import request_memo
+
 # TODO: we need some way for clients to get their user instance...
 class BaseAuthenticator(object):
     gateways = ()
@@ -20,6 +25,21 @@ class BaseAuthenticator(object):
         
         self.gateways = \
             [g(resource_site, self, resource) for g in self.gateways]
+
+        # Look the tests up once, rather than on every request.
+        self.tests = self.compile_tests()
+
+    def get_tests(self):
+        """
+        Returns the names of the test methods to run for each request. Tests
+        which can't fail with the authenticator's options should be left
+        out.
+        
+        """
+        return self.auth_tests
+
+    def compile_tests(self):
+        return [getattr(self, name) for name in self.get_tests()]
     
     def is_authenticated(self, request, handler):
         self.set_user(request)
@@ -33,15 +53,13 @@ class BaseAuthenticator(object):
         """
         user = None
         for gateway in self.gateways:
-            if user.is_authenticated():
+            user = gateway.get_user(request)
+            if user is not None:
                 break
-            u = gateway.get_user(request)
-            if u is None: user = u
         request.user = user
 
-    def run_tests(self, request, handler, tests=[]):
-        for t in tests:
-            test = getattr(self, t, lambda r, h: True)
+    def run_tests(self, request, handler):
+        for test in self.tests:
             if not test(request, handler):
                 return False
         
@@ -66,17 +84,72 @@ class DjangoAuthenticator(BaseAuthenticator):
     handler_permissions = {} # Maps handler names to their required permissions.
     method_permissions = {} # Maps method names to their required permissions.
     permissions = () # Permissions required for accessing this resource.
+    perms_cache_timeout = 0 # Seconds to cache permission checks for in the
+                            # client's session. 0 disables the session cache.
     
     def set_user(self, request):
         super(DjangoAuthenticator, self).set_user(request)
         if request.user is None:
             request.user = AnonymousUser()
 
-    def run_tests(self, request, handler, tests=[]):
-        tests = ['login_check', 'staff_member_check', 'admin_perms_check']
-        tests += ['permissions_check'] # TODO: add in other checks...
-        return super(DjangoAuthenticator, self).run_tests(
-            request, handler, tests)
+    def get_tests(self):
+        tests = []
+        if self.login_required:
+            tests.append('login_check')
+        if self.staff_member_required:
+            tests.append('staff_member_check')
+        if self.admin_perms_required:
+            tests.append('admin_perms_check')
+        if self.permissions:
+            tests.append('perms_check')
+        # TODO: add in other checks...
+        return tests
+
+    def has_perms(self, request, perms):
+        """
+        Returns True if the request's user has all of the given permissions.
+        
+        Results are cached per user and permission for the rest of the
+        request, and for `perms_cache_timeout` seconds in the session.
+        
+        """
+        user = request.user
+        memo = request_memo()
+        session = None
+        if self.perms_cache_timeout and user.is_authenticated():
+            session = getattr(request, 'session', None)
+            # Other users may log in through the same session later on.
+            session_key = 'djangocore:perms:%s' % user.pk
+
+        for perm in perms:
+            key = ('djangocore:perm', user.pk, perm)
+            result = memo.get(key)
+            if result is None and session is not None:
+                cached = session.get(session_key, {}).get(perm)
+                if cached and cached[1] > time.time():
+                    result = cached[0]
+            if result is None:
+                result = user.has_perm(perm)
+                if session is not None:
+                    cached = session.get(session_key, {})
+                    cached[perm] = (result, 
+                        time.time() + self.perms_cache_timeout)
+                    session[session_key] = cached
+            memo[key] = result
+            if not result:
+                return False
+        return True
+
+    def has_admin_perms(self, request, actions):
+        """
+        Returns True if the request's user has the admin permissions for all
+        of the given actions ('add', 'change' or 'delete') on the resource's
+        model.
+        
+        """
+        opts = self.resource.model._meta
+        return self.has_perms(request, ['%s.%s_%s' % (opts.app_label, action,
+            opts.module_name) for action in actions])
 
     def login_check(self, request, handler):
         # Make sure client is logged in, if the resource requires it.
@@ -97,20 +170,17 @@ class DjangoAuthenticator(BaseAuthenticator):
             p = {'GET': 'change', 'POST': 'add', 'PUT': 'change',
                 'DELETE': 'delete'}
             rm = request.method.upper()
-            ops = self.model._meta
-
-            return request.user.has_perm('%s.%s_%s' %
-              (ops.app_label, p.get(rm), ops.module_name))
+            return self.has_admin_perms(request, [p.get(rm)])
         
         return True
 
     def perms_check(self, request, handler):
         # Make sure the client has the required permissions, if specified.
-        required_perms = self.required_perms
+        required_perms = self.permissions
         if required_perms:
             if not hasattr(required_perms, '__iter__'):
                 required_perms = [required_perms]
-            if not request.user.has_perms(required_perms):
+            if not self.has_perms(request, required_perms):
                 return False
         
         # The client passed all authentication tests.
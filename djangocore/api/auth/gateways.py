@@ -1,3 +1,8 @@
+import copy
+from datetime import datetime
+
+from django.utils.encoding import smart_str
+
 class BaseGateway(object):
     """
     Provides client identification logic (i.e. login) and optionally
@@ -14,6 +19,14 @@ class BaseGateway(object):
     def get_user(self, request):
         raise NotImplementedError
 
+    def get_parameters(self):
+        """
+        Returns the names of the GET parameters the gateway reads, which
+        resources shouldn't mistake for lookups.
+        
+        """
+        return ()
+
 class CookieDjangoUserGateway(BaseGateway):
     """
     A simple gateway which looks for clients that are logged in with
@@ -27,21 +40,77 @@ class CookieDjangoUserGateway(BaseGateway):
 
 class TokenDjangoUserGateway(BaseGateway):
     token_field_name = None
+    token_parameter = 'token'
+    
+    def get_parameters(self):
+        return (self.token_parameter,)
     
     def get_user(self, request):
-        token = request.GET.get('token', None)
+        token = request.GET.get(self.token_parameter, None)
         if token:
             from django.contrib.auth.models import User
             from django.core.exceptions import MultipleObjectsReturned
             
             lookups = {}
-            lookups[token_field_name] = token
+            lookups[self.token_field_name] = token
             try:
                 return User.objects.get(**lookups)
-            except User.DoesNotExist, MultipleObjectsReturned:
+            except (User.DoesNotExist, MultipleObjectsReturned):
                 pass
         return None
 
+class APITokenGateway(BaseGateway):
+    """
+    Identifies clients by an `APIToken`, passed in the `token` GET parameter
+    or in an "Authorization: Token <token>" header.
+    
+    Tokens are looked up by their digest, and the users they belong to are
+    kept in an in-process cache, so that repeat requests with the same token
+    don't touch the database.
+    
+    """
+    token_parameter = 'token'
+    
+    def __init__(self, *args, **kwargs):
+        from djangocore.models import track_token_users
+        
+        super(APITokenGateway, self).__init__(*args, **kwargs)
+        track_token_users()
+    
+    def get_parameters(self):
+        return (self.token_parameter,)
+    
+    def get_token(self, request):
+        authorization = request.META.get('HTTP_AUTHORIZATION', '').split()
+        if len(authorization) == 2 and authorization[0].lower() == 'token':
+            return authorization[1]
+        return request.GET.get(self.token_parameter, None)
+    
+    def get_user(self, request):
+        from djangocore.models import APIToken, token_cache, hash_token
+        
+        token = self.get_token(request)
+        if not token:
+            return None
+        
+        digest = hash_token(smart_str(token))
+        cached = token_cache.get(digest)
+        if cached is None:
+            try:
+                obj = APIToken.objects.select_related('user').get(
+                    digest=digest)
+            except APIToken.DoesNotExist:
+                return None
+            cached = (obj.user, obj.expires)
+            token_cache.set(digest, cached)
+        
+        user, expires = cached
+        if not user.is_active or (expires and expires < datetime.now()):
+            return None
+        # Hand out a copy, so that nothing cached on the user during one
+        # request (e.g. its permissions) leaks into the next.
+        return copy.copy(user)
+
 
 
 
@@ -9,13 +9,11 @@ from djangocore.api.resources import BaseResource
 class FormResource(BaseResource):
     form = None # a model form class to use when creating and updating objects
 
-    def get_urls(self):
-        from django.conf.urls.defaults import patterns, url
-        urlpatterns = patterns('',
-            url('^form/$',      self.mapper,    self.ops(get='form')),
-            url('^$',           self.mapper,    self.ops(post='submit')),
-        )
-        return urlpatterns
+    def get_routes(self):
+        return [
+            ('form/',   self.ops(get='form')),
+            ('',        self.ops(post='submit')),
+        ]
     
     def get_url_prefix(self):
         return 'forms/%s/' % underscore(self.__class__.__name__)
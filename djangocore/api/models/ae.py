@@ -81,7 +81,8 @@ class AppEngineModelResource(BaseModelResource):
 
         # TODO: how do we catch bad format requests?
         format = request.GET.get('format', 'json')
-        response = emitter.translate(format, response)
+        pretty = request.GET.get('pretty', '') in ('1', 'true')
+        response = emitter.translate(format, response, pretty=pretty)
         return response
 
     def process_lookups(self, lookups):
@@ -91,6 +92,8 @@ class AppEngineModelResource(BaseModelResource):
         """
         newlookups = {}
         for k, v in lookups.items():
+            if k in self.reserved_lookups:
+                continue
             if '__' in k:
                 l = k.rsplit(self.lookup_delimiter, 1)
                 n = self.lookup_mapper.get(l[-1], '')
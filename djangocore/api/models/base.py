@@ -15,6 +15,12 @@ class BaseModelResource(BaseResource):
     model = None
     form = None # a model form class to use when creating and updating objects
     fields = () # the fields to expose when serializing this model
+    serialization_plan_class = None # precompiles serialization, if given
+    select_related = () # relations to load in the same query as the objects
+    prefetch_related = () # relations to load in one extra query per page
+    infer_related = True # also load the many to many fields and the relations
+                         # named in the `sd_depends` of exposed methods
+    reserved_lookups = ('format', 'pretty') # GET parameters that aren't lookups
     
     def __init__(self, *args, **kwargs):
         super(BaseModelResource, self).__init__(*args, **kwargs)
@@ -24,22 +30,34 @@ class BaseModelResource(BaseResource):
             raise TypeError("%s must specify a model attribute" %
                 self.__class__.__name__)
 
-    def get_urls(self):
-        from django.conf.urls.defaults import patterns, url
-        urlpatterns = patterns('',
-            url('^length/$',    self.mapper,    self.ops(get='length')),
-            url('^list/$',      self.mapper,    self.ops(get='list')),
-            url('^form/$',      self.mapper,    self.ops(get='form')),
-            url('^$',           self.mapper,    self.ops(get='show', \
-              post='create', put='update', delete='destroy')),
-        )
+        # The parameters the gateways read (e.g. API tokens) aren't lookups.
+        self.reserved_lookups = tuple(self.reserved_lookups)
+        for gateway in getattr(self.authenticator, 'gateways', ()):
+            self.reserved_lookups += tuple(gateway.get_parameters())
+
+        # Build the serialization plan once, when the resource is registered,
+        # so that no introspection has to happen while serializing responses.
+        self.serialization_plan = None
+        if self.serialization_plan_class:
+            self.serialization_plan = \
+                self.serialization_plan_class(self.model, self.fields)
+
+    def get_routes(self):
+        routes = [
+            ('length/', self.ops(get='length')),
+            ('list/',   self.ops(get='list')),
+            ('page/',   self.ops(get='page')),
+            ('batch/',  self.ops(post='batch')),
+            ('form/',   self.ops(get='form')),
+            ('',        self.ops(get='show', post='create', put='update', \
+              delete='destroy')),
+        ]
         for name in dir(self.model):
             obj = getattr(self.model, name)
             if (inspect.ismethod(obj) or inspect.isfunction(obj)):
               if obj.func_dict.get("attr")=="exposeClass":
-                  urlpatterns+=patterns('', url('^'+name+"/", self.mapper, {'GET': obj}),)
-        #print urlpatterns
-        return urlpatterns
+                  routes.append((name + '/', {'GET': obj}))
+        return routes
 
     def get_url_prefix(self):
         ops = self.model._meta
@@ -51,6 +69,12 @@ class BaseModelResource(BaseResource):
         for later serialization.
         
         """
+        plan = self.serialization_plan
+        if plan:
+            if not hasattr(model_or_iterable, '__iter__'):
+                return plan.serialize(model_or_iterable)
+            return plan.serialize_many(model_or_iterable)
+
         iterable = True
         if not hasattr(model_or_iterable, '__iter__'):
             model_or_iterable = [model_or_iterable]
@@ -125,6 +149,9 @@ class BaseModelResource(BaseResource):
     def list(self, request):
         raise NotImplementedError
 
+    def page(self, request):
+        raise NotImplementedError
+
     def meta(self, request):
         return transformer.render(self.form)
 
@@ -139,3 +166,6 @@ class BaseModelResource(BaseResource):
 
     def destroy(self, request):
         raise NotImplementedError
+
+    def batch(self, request):
+        raise NotImplementedError
@@ -0,0 +1,55 @@
+"""
+Helpers for counting the rows of a QuerySet more cheaply than a plain
+`COUNT(*)` over the whole result set.
+
+"""
+import re
+
+# Django dependencies.
+from django.db import connections
+from django.db.models.sql.datastructures import EmptyResultSet
+
+explain_rows_expression = re.compile(r'rows=(\d+)')
+
+def query_sql(qs):
+    """Returns the (sql, params) tuple the given QuerySet would execute."""
+    return qs.query.get_compiler(qs.db).as_sql()
+
+def capped_count(qs, max_count):
+    """
+    Counts the rows of the given QuerySet, but stops counting once it
+    reaches `max_count`, so that the database doesn't have to visit every
+    matching row.
+
+    """
+    try:
+        sql, params = query_sql(qs.values('pk')[:max_count])
+    except EmptyResultSet:
+        return 0
+    cursor = connections[qs.db].cursor()
+    cursor.execute('SELECT COUNT(*) FROM (%s) capped_count' % sql, params)
+    return cursor.fetchone()[0]
+
+def estimate_count(qs):
+    """
+    Returns the query planner's estimate of the number of rows the given
+    QuerySet would return, or None if the database can't tell us.
+
+    Only PostgreSQL is supported at the moment.
+
+    """
+    connection = connections[qs.db]
+    if connection.vendor != 'postgresql':
+        return None
+
+    try:
+        sql, params = query_sql(qs.values('pk'))
+    except EmptyResultSet:
+        return 0
+    cursor = connection.cursor()
+    cursor.execute('EXPLAIN %s' % sql, params)
+    row = cursor.fetchone()
+    match = row and explain_rows_expression.search(row[0])
+    if match:
+        return int(match.group(1))
+    return None
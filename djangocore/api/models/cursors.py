@@ -0,0 +1,163 @@
+"""
+Helpers for keyset (a.k.a. cursor or seek) pagination.
+
+Instead of asking the database to skip `offset` rows, the client passes
+back an opaque cursor holding the ordering values of the last row it
+received. The next page is then everything that sorts strictly after that
+row, which an index on the ordering columns can answer directly, no
+matter how deep into the result set the client is.
+
+The primary key is always appended to the ordering, so that the sort
+order (and therefore the cursor) is unambiguous. Nullable fields can't be
+used, since databases disagree on where NULLs sort.
+
+"""
+import base64
+import datetime
+
+# Django dependencies.
+from django.core.exceptions import ValidationError
+from django.db.models.fields import FieldDoesNotExist
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Model, Q
+from django.utils import simplejson
+
+class InvalidCursor(ValueError):
+    """Raised when a cursor can't be decoded or used for the query."""
+    pass
+
+class CursorEncoder(DjangoJSONEncoder):
+    """Encodes times with their microseconds, which DjangoJSONEncoder drops."""
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat(' ')
+        if isinstance(o, datetime.time):
+            return o.isoformat()
+        return super(CursorEncoder, self).default(o)
+
+def path_field(model, o):
+    """
+    Returns the field at the end of the given ordering (e.g.
+    '-poll__question'), raising InvalidCursor if it can't be used for
+    keyset pagination.
+
+    """
+    path = o.lstrip('-').split('__')
+    for i, name in enumerate(path):
+        opts = model._meta
+        try:
+            field = name == 'pk' and opts.pk or opts.get_field(name)
+        except FieldDoesNotExist:
+            raise InvalidCursor("Can't page by cursor when ordering by %s."
+                % o)
+        if field.null:
+            raise InvalidCursor("Can't page by cursor when ordering by %s, "
+                "which can be null." % o)
+        if i < len(path) - 1:
+            if not field.rel:
+                raise InvalidCursor("Can't page by cursor when ordering by "
+                    "%s." % o)
+            model = field.rel.to
+    return field
+
+def ordering_field(model, o):
+    """
+    Returns the field the given ordering sorts on. Foreign keys are compared
+    by the value of their related field.
+
+    """
+    field = path_field(model, o)
+    while field.rel:
+        field = field.rel.get_related_field()
+    return field
+
+def keyset_ordering(model, ordering):
+    """
+    Returns the given ordering with the primary key appended as a
+    tiebreaker, if it isn't already part of it. Foreign keys are replaced
+    by the field they point to (e.g. 'poll' by 'poll__id'), so that rows
+    sort by the values the cursor compares, rather than by the related
+    model's `Meta.ordering`.
+
+    """
+    ordering = list(ordering or [])
+    pk_names = ('pk', model._meta.pk.name)
+    for i, o in enumerate(ordering):
+        if o == '?':
+            raise InvalidCursor("Random ordering can't be paged by cursor.")
+        field = path_field(model, o)
+        while field.rel:
+            field = field.rel.get_related_field()
+            o = '%s__%s' % (o, field.name)
+        ordering[i] = o
+    if not ordering or ordering[-1].lstrip('-') not in pk_names:
+        ordering.append('pk')
+    return ordering
+
+def encode_cursor(values):
+    data = simplejson.dumps(values, cls=CursorEncoder, separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode('utf-8'))
+
+def decode_cursor(cursor, model, ordering):
+    """
+    Decodes a cursor into one value per ordering field, converted to the
+    field's python type.
+
+    """
+    try:
+        values = simplejson.loads(base64.urlsafe_b64decode(str(cursor)))
+    except (TypeError, ValueError):
+        raise InvalidCursor("The cursor sent in the request is malformed.")
+    if not isinstance(values, list) or len(values) != len(ordering):
+        raise InvalidCursor("The cursor doesn't match the requested ordering.")
+    try:
+        values = [ordering_field(model, o).to_python(value)
+            for o, value in zip(ordering, values)]
+    except (ValidationError, TypeError, ValueError):
+        raise InvalidCursor("The cursor sent in the request is malformed.")
+    if None in values:
+        raise InvalidCursor("The cursor sent in the request is malformed.")
+    return values
+
+def cursor_values(obj, ordering):
+    """
+    Reads the values of the ordering fields off of the given object. The
+    fields that foreign keys point to are read from the foreign key's
+    attname, so that no related objects have to be loaded.
+
+    """
+    values = []
+    for o in ordering:
+        path = o.lstrip('-').split('__')
+        value = obj
+        while path and value is not None:
+            name = path.pop(0)
+            opts = value._meta
+            field = name == 'pk' and opts.pk or opts.get_field(name)
+            if field.rel and (not path or
+              path == [field.rel.get_related_field().name]):
+                path, name = [], field.attname
+            value = getattr(value, name)
+        if isinstance(value, Model):
+            value = value.pk
+        values.append(value)
+    return values
+
+def seek_filter(ordering, values):
+    """
+    Returns a Q object selecting all rows that sort after the given values,
+    i.e. the row-value comparison `(a, b, pk) > (x, y, z)` expanded into
+    `a > x OR (a = x AND b > y) OR (a = x AND b = y AND pk > z)`.
+
+    Descending fields compare with `lt` instead of `gt`.
+
+    """
+    q = None
+    equal = Q()
+    for o, value in zip(ordering, values):
+        name = o.lstrip('-')
+        op = o.startswith('-') and 'lt' or 'gt'
+        after = equal & Q(**{str('%s__%s' % (name, op)): value})
+        q = q is None and after or q | after
+        equal &= Q(**{str(name): value})
+    return q
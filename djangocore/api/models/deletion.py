@@ -0,0 +1,63 @@
+"""
+Helpers for the destroy strategies of model resources.
+
+Django's collector loads every object it deletes, so that it can cascade
+to related objects and send the pre_delete and post_delete signals. For
+models without dependent relations or signal receivers, none of that is
+needed, and the rows can be deleted with plain DELETE queries instead.
+
+"""
+# Django dependencies.
+from django.db.models import signals
+from django.db.models.sql.subqueries import DeleteQuery
+from django.dispatch.dispatcher import _make_id
+
+destroy_strategies = ('collector', 'raw', 'chunked')
+
+def foreign_receivers(signal, model):
+    """
+    Returns the receivers of the given signal which listen for the given
+    model (or for every model), leaving out our own cache invalidation
+    receivers, which the raw strategy takes care of itself.
+
+    """
+    sender_keys = (_make_id(model), _make_id(None))
+    return [receiver for (receiver_key, sender_key), receiver in
+        signal.receivers if sender_key in sender_keys and not
+        str(receiver_key).startswith('djangocore:')]
+
+def raw_delete_blockers(model):
+    """
+    Returns a list of reasons why the rows of the given model can't be
+    deleted without the collector, which is empty if they can.
+
+    """
+    opts = model._meta
+    blockers = []
+    if opts.parents:
+        blockers.append("it inherits from another model")
+    if opts.get_all_related_objects(include_hidden=True):
+        blockers.append("other models have foreign keys to it")
+    if opts.many_to_many or opts.get_all_related_many_to_many_objects():
+        blockers.append("it has many to many relations")
+    for signal in (signals.pre_delete, signals.post_delete):
+        if foreign_receivers(signal, model):
+            blockers.append("it has delete signal receivers")
+            break
+    return blockers
+
+def raw_delete(model, pk_list, using):
+    """
+    Deletes the rows with the given primary keys, without loading them
+    or sending any signals. Django's DeleteQuery runs one DELETE query per
+    100 primary keys, which keeps each query under the parameter limits of
+    databases like SQLite. The caller selects the primary keys first, since
+    it needs them to invalidate the object cache.
+
+    """
+    DeleteQuery(model).delete_batch(pk_list, using)
+
+def chunks(sequence, size):
+    """Yields successive slices of the given sequence of the given size."""
+    for offset in range(0, len(sequence), size):
+        yield sequence[offset:offset + size]
@@ -1,32 +1,126 @@
 # Django dependencies.
-from django.core.exceptions import FieldError
+from django.core.cache import cache
+from django.core.exceptions import FieldError, ValidationError, \
+  ImproperlyConfigured
 from django.db.models.query import QuerySet
 from django.http import HttpResponse
 from django.forms.models import modelform_factory
 from django.shortcuts import get_object_or_404
+from django.db import transaction
 from django.db.models import Q
-from query_translator import translator
+from django.db.models.fields import FieldDoesNotExist
+from django.db.models.sql.datastructures import EmptyResultSet
+from django.utils.hashcompat import md5_constructor
+from django.utils.encoding import smart_str
+from query_translator import translator, QueryError
 
 # Intra-app dependencies.
+from djangocore.api.utils import Bubbler
 from djangocore.api.models.base import BaseModelResource
-from djangocore.serialization import emitter, EmittableResponse
+from djangocore.api.models.counts import query_sql, capped_count, \
+  estimate_count
+from djangocore.api.models.indexes import logger, record_unindexed_query
+from djangocore.api.models.deletion import destroy_strategies, \
+  raw_delete_blockers, raw_delete, chunks
+from djangocore.api.models.objects import track_objects, \
+  get_cached_objects, set_cached_objects, invalidate_objects
+from djangocore.api.models.versions import track_model, get_model_version, \
+  bump_model_version
+from djangocore.api.models.cursors import InvalidCursor, keyset_ordering, \
+  encode_cursor, decode_cursor, cursor_values, seek_filter
+from djangocore.api.models.serializers import SerializationPlan
+from djangocore.serialization import emitter, mimer, EmittableResponse, \
+  StreamingResponse
 
 from urllib import unquote_plus
+import time
+
+def iterable(obj):
+    """django nowadays plants all vars in lists. 
+    i.e.
+    <QueryDict: {u'ordering': [u'name'], u'limit': [u'0'], u'conditions': [u'ipPublic = {ipp} AND ipUmts = {ipu}'], u'parameters': [u'ipp=192.168.1.1,ipu=frank,'], u'offset': [u'0']}>
+    Thus, this function detects lists and returns the first object, if possible
+    """
+    if hasattr(obj, '__getitem__'):
+        if len(obj)>0:
+            return obj[0]
+        else:
+            return obj
+    else:
+        return obj
 
 class DjangoModelResource(BaseModelResource):
     allow_related_ordering = False # Allow ordering across relationships.
     user_field_name = None # The field to filter on the current user.
                            # Only logged in users get filtered responses.
+    serialization_plan_class = SerializationPlan
+    stream_chunk_size = 0 # When set, list responses are encoded and sent
+                          # to the client this many objects at a time, so the
+                          # encoded page is never held in memory as a whole.
+                          # The objects are still loaded and serialized inside
+                          # the view, before the first byte is sent.
+    count_cache_timeout = 0 # Seconds to cache counts for. 0 disables caching.
+    use_etags = False # Validate list, page, show and length responses with
+                      # ETags derived from the model's version.
+    object_cache_timeout = 0 # Seconds to cache serialized objects for, when
+                             # they are shown by pk. 0 disables caching. The
+                             # pks are still checked against get_query_set.
+    approximate_count_threshold = None # When set, planner estimates above
+                                       # this number are returned as counts.
+    max_batch_size = 500 # max number of operations in a batch request
+    destroy_strategy = 'collector' # How objects are deleted: 'collector' (by
+                                   # Django, cascading and sending signals),
+                                   # 'raw' (a SELECT of the pks, then one
+                                   # DELETE query per 100 pks, for models
+                                   # without relations or signal receivers)
+                                   # or 'chunked' (by Django, one transaction
+                                   # per destroy_chunk_size objects).
+    destroy_chunk_size = 500
+    translator_class = translator # Translates conditions into Q objects.
+    max_query_cost = None # The highest allowed cost of the conditions (or
+                          # plain lookups) of a query.
+    unindexed_query_policy = 'allow' # What to do with queries that order or
+                                     # filter on unindexed columns: 'allow',
+                                     # 'warn' (log them) or 'reject' them.
 
-    translator = None
+    translator = None # The translator_class instance for this resource.
     
     def __init__(self, *args, **kwargs):
         super(DjangoModelResource, self).__init__(*args, **kwargs)
 
-        """ create a translator object, so we have the regex' cached """
-        self.translator = translator()
+        """ create a translator object, so that the compiled queries and the
+        resolved model fields are cached """
+        self.translator = self.translator_class(self.model,
+            max_cost=self.max_query_cost)
 
+        # Record which of the model's fields are indexed. This also primes the
+        # translator's cache of resolved field paths.
+        self.indexed_fields = [f.name for f in self.model._meta.fields
+            if self.translator.resolve_path(f.name)[2]]
         
+        # Cached data is invalidated by bumping the model's version on writes.
+        if self.count_cache_timeout or self.use_etags:
+            track_model(self.model)
+        if self.object_cache_timeout and self.serialization_plan:
+            local_names = [f.name for f in self.model._meta.fields
+                if not f.rel]
+            track_objects(self.model, self.serialization_plan.signature,
+                [path for path in self.get_depends()
+                    if path not in local_names])
+
+        if self.destroy_strategy not in destroy_strategies:
+            raise ImproperlyConfigured("%s.destroy_strategy must be one of %s" %
+                (self.__class__.__name__, ', '.join(destroy_strategies)))
+        if self.destroy_strategy == 'raw':
+            blockers = raw_delete_blockers(self.model)
+            if blockers:
+                raise ImproperlyConfigured("%s can't use the raw destroy "
+                    "strategy for %s, because %s." % (self.__class__.__name__,
+                    self.model.__name__, ' and '.join(blockers)))
+
+        self.related_paths = self.get_related_paths()
+        self.only_fields = self.get_only_fields()
+
         # Construct a default form if we don't have one already.
         if not self.form:
             if self.fields:
@@ -44,78 +138,287 @@ class DjangoModelResource(BaseModelResource):
             return response
         
         if isinstance(response, QuerySet):
-            response = self.serialize_models(response)
+            plan = self.serialization_plan
+            response = EmittableResponse(list(self.serialize_query_set(
+                response)), clean=plan is not None and plan.clean)
         
         # TODO: how do we catch bad format requests?
         format = request.GET.get('format', 'json')
-        response = emitter.translate(format, response)
+        pretty = request.GET.get('pretty', '') in ('1', 'true')
+        response = emitter.translate(format, response, pretty=pretty)
         return response
 
+    def get_etag(self, request, handler):
+        """
+        Derives the ETag of read-only responses from the model's version and
+        a hash of the request's arguments, so that a matching If-None-Match
+        header can be answered without running any queries.
+        
+        Only changes to the model itself are tracked: resources with exposed
+        methods that read from other models shouldn't enable ETags.
+        
+        """
+        if not self.use_etags or getattr(handler, '__name__', None) not in \
+          ('list', 'page', 'show', 'length'):
+            return None
+        version = get_model_version(self.model)
+        if version is None:
+            return None
+        
+        arguments = sorted([(smart_str(k), map(smart_str, v))
+            for k, v in request.GET.lists()])
+        user = None
+        if self.user_field_name:
+            user = getattr(request.user, 'pk', None)
+        digest = md5_constructor(repr((self.url_prefix, handler.__name__,
+            arguments, user)))
+        return '%s-%s' % (version, digest.hexdigest())
+
+    def serialize_query_set(self, qs):
+        """
+        Lazily serializes the objects in the given QuerySet. When the
+        resource restricts its `fields`, only the columns that are needed
+        are loaded: as plain tuples if the serialization plan can work with
+        those, or as deferred instances if many to many fields or exposed
+        methods need model instances.
+        
+        The rows are read from the database right away, so that no cursor
+        is left open once the view returns a streamed response.
+        
+        """
+        plan = self.serialization_plan
+        if not plan:
+            return iter(self.serialize_models(qs))
+        if self.fields:
+            if not plan.needs_instances:
+                rows = list(qs.values_list(*plan.columns).iterator())
+                return plan.iter_serialize_rows(rows)
+            qs = qs.only(*self.only_fields)
+        if self.related_paths[1]:
+            # Prefetched relations are only attached when the QuerySet is
+            # evaluated as a whole.
+            return plan.iter_serialize(list(qs))
+        return plan.iter_serialize(list(qs.iterator()))
+
     def process_lookups(self, lookups):
         """
         GET parameter keys are unicode strings, but we can only pass in
         strings as keyword arguments, so we convert them here.
         
         """
-        return dict([(str(k), v) for k, v in lookups.items()])
+        return dict([(str(k), v) for k, v in lookups.items()
+            if k not in self.reserved_lookups])
+
+    def filter_lookups(self, lookups):
+        """
+        Returns the processed plain lookups, raising QueryCostError if they
+        are more expensive than the budget for conditions allows.
+        
+        """
+        lookups = self.process_lookups(lookups)
+        if self.translator.max_cost is not None:
+            template = self.translator.compile_lookups(lookups)
+            self.translator.check_cost(self.translator.cost(template))
+        return lookups
+
+    def get_related_paths(self):
+        """
+        Returns the lists of relations to pass to `select_related` and
+        `prefetch_related` when querying the model. Besides the declared
+        ones, the serialized many to many fields and the `sd_depends` of
+        exposed methods are loaded up front if `infer_related` is set, so
+        that serializing a page doesn't run a query per object.
+        
+        """
+        select = list(self.select_related)
+        prefetch = list(self.prefetch_related)
+        for path in select:
+            if not self.is_single_valued(path):
+                raise ImproperlyConfigured("%s can't select the related %r, "
+                    "since it is a to-many relation. Use prefetch_related "
+                    "instead." % (self.__class__.__name__, path))
+        plan = self.serialization_plan
+        if self.infer_related and plan:
+            paths = list(plan.m2m_names) + self.get_depends()
+            local_names = [f.name for f in self.model._meta.fields
+                if not f.rel]
+            for path in paths:
+                if path in local_names:
+                    # A plain column, see `get_only_fields`.
+                    continue
+                if self.is_single_valued(path):
+                    related = select
+                else:
+                    related = prefetch
+                if path not in related:
+                    related.append(path)
+
+        if not hasattr(QuerySet, 'prefetch_related'):
+            # Django < 1.4 can't prefetch relations.
+            prefetch = []
+        return select, prefetch
+
+    def get_depends(self):
+        """
+        Returns the fields and relation paths named in the `sd_depends` of
+        the exposed methods.
+        
+        """
+        plan = self.serialization_plan
+        paths = []
+        for name, method in plan and plan.exposed or ():
+            depends = getattr(method, 'sd_depends', ())
+            if isinstance(depends, basestring):
+                depends = [depends]
+            paths.extend(depends)
+        return paths
+
+    def get_only_fields(self):
+        """
+        Returns the fields to load when the resource restricts its `fields`
+        but has to serialize model instances: the columns of the
+        serialization plan, the relations to load along with the objects and
+        the local fields named in the `sd_depends` of exposed methods.
+        
+        """
+        plan = self.serialization_plan
+        if not plan:
+            return []
+        names = list(plan.columns)
+        local_names = [f.name for f in self.model._meta.fields]
+        paths = self.related_paths[0] + self.related_paths[1] + \
+            self.get_depends()
+        for path in paths:
+            name = path.split('__')[0]
+            if name in local_names and name not in names:
+                names.append(name)
+        return names
+
+    def is_single_valued(self, path):
+        """
+        Returns True if the given relation path only follows foreign keys
+        and one to one fields forward, so it can be joined in with
+        `select_related`.
+        
+        """
+        model = self.model
+        for name in path.split('__'):
+            try:
+                field, m, direct, m2m = model._meta.get_field_by_name(name)
+            except FieldDoesNotExist:
+                raise ImproperlyConfigured("%s depends on the relation %r, "
+                    "but %s has no field named %r." % (self.__class__.__name__,
+                    path, model.__name__, name))
+            if not direct or m2m:
+                return False
+            if not field.rel:
+                raise ImproperlyConfigured("%s depends on the relation %r, "
+                    "but %s.%s is not a relation." % (self.__class__.__name__,
+                    path, model.__name__, name))
+            model = field.rel.to
+        return True
 
     def get_query_set(self, request):
         qs = self.model._default_manager.all()
+        select, prefetch = self.related_paths
+        if select:
+            qs = qs.select_related(*select)
+        if prefetch:
+            qs = qs.prefetch_related(*prefetch)
         if self.user_field_name and hasattr(request.user, 'pk'):
             lookups = {}
             lookups[self.user_field_name] = request.user
             qs = qs.filter(**lookups)
         return qs
 
+    def count(self, qs, max_count=None):
+        """
+        Counts the objects in the given QuerySet, stopping at `max_count` if
+        given. Uses the count cache and planner estimates, if enabled.
+        
+        """
+        key = version = None
+        if self.count_cache_timeout:
+            version = get_model_version(self.model)
+        if version is not None:
+            # The SQL covers the user filter and the (normalized) lookups, and
+            # the model version takes care of invalidation.
+            try:
+                sql, params = query_sql(qs)
+            except EmptyResultSet:
+                return 0
+            digest = md5_constructor(repr((sql, params, max_count)))
+            key = 'djangocore:count:%s:%s:%s' % (self.url_prefix, version,
+                digest.hexdigest())
+            count = cache.get(key)
+            if count is not None:
+                return count
+
+        count = None
+        if self.approximate_count_threshold is not None:
+            estimate = estimate_count(qs)
+            if estimate is not None and \
+              estimate > self.approximate_count_threshold:
+                count = estimate
+                if max_count:
+                    count = min(count, max_count)
+        if count is None:
+            if max_count:
+                count = capped_count(qs, max_count)
+            else:
+                count = qs.count()
+
+        if key:
+            cache.set(key, count, self.count_cache_timeout)
+        return count
+
     def length(self, request):
         lookups = request.GET.copy()
+        try:
+            max_count = int(lookups.pop('max', [0])[0])
+        except ValueError:
+            return EmittableResponse("The max argument must be an integer",
+                status=400)
+        if max_count < 0:
+            return EmittableResponse("The max argument cannot be negative",
+                status=400)
 
         qs = self.get_query_set(request)
         
         try:
-            qs = qs.filter(**self.process_lookups(lookups))
-        except FieldError, err:
+            qs = qs.filter(**self.filter_lookups(lookups))
+        except (FieldError, QueryError), err:
             return EmittableResponse(str(err), status=400)
         
-        return qs.count()
-
-    def list(self, request):
-        def iterable(obj):
-            """django nowadays plants all vars in lists. 
-            i.e.
-            <QueryDict: {u'ordering': [u'name'], u'limit': [u'0'], u'conditions': [u'ipPublic = {ipp} AND ipUmts = {ipu}'], u'parameters': [u'ipp=192.168.1.1,ipu=frank,'], u'offset': [u'0']}>
-            Thus, this function detects lists and returns the first object, if possible
-            """
-            if hasattr(obj, '__getitem__'):
-                if len(obj)>0:
-                    return obj[0]
-                else:
-                    return obj
-            else:
-                return obj
-
-        lookups = request.GET.copy()
-
+        return self.count(qs, max_count)
 
+    def filter_query_set(self, request, lookups):
+        """
+        Returns the user's QuerySet, ordered and filtered according to the
+        `ordering`, `conditions` and `parameters` arguments (or any plain
+        lookups) in the given lookups, along with the list of orderings.
+        
+        Invalid requests are bubbled up as a 400 response.
+        
+        """
         qs = self.get_query_set(request)
 
         ordering = iterable(lookups.pop('ordering', None))
         if ordering:
             if not self.allow_related_ordering and '__' in ordering:
-                return EmittableResponse("This model cannot be ordered by "
-                    "related objects. Please remove all ocurrences of '__' from"
-                    " your ordering parameters.", status=400)
+                raise Bubbler(EmittableResponse("This model cannot be ordered "
+                    "by related objects. Please remove all ocurrences of '__' "
+                    "from your ordering parameters.", status=400))
             ordering = ordering.split(',')            
             if len(ordering) > self.max_orderings:
-                return EmittableResponse("This model cannot be ordered by more "
-                    "than %d parameter(s). You tried to order by %d parameters."
-                    % (self.max_orderings, len(ordering)), status=400)
+                raise Bubbler(EmittableResponse("This model cannot be ordered "
+                    "by more than %d parameter(s). You tried to order by %d "
+                    "parameters." % (self.max_orderings, len(ordering)),
+                    status=400))
             qs = qs.order_by(*ordering)
 
-        offset = int(iterable(lookups.pop('offset', 0)))
-        limit = min(int(iterable(lookups.pop('limit', self.max_objects))), int(iterable(self.max_objects)))
-        
         filter_q_object = None
+        conditionsString = None
         """ check if we have conditions and request parameters """
         conditions = iterable(lookups.pop('conditions', ""))
         if conditions!="" and conditions!=None and conditions!=0:
@@ -134,7 +437,14 @@ class DjangoModelResource(BaseModelResource):
 
             """the format is a=b AND c=d OR """
             """ and now create a Q object from the query string """
-            filter_q_object = self.translator.parse(conditionsString, parameters)
+            try:
+                filter_q_object = self.translator.parse(conditionsString,
+                    parameters)
+            except QueryError, err:
+                raise Bubbler(EmittableResponse(str(err), status=400))
+
+        if self.unindexed_query_policy != 'allow':
+            self.check_indexes(ordering, conditionsString)
         
         try:
             # Catch any lookup errors, and return the message, since they are
@@ -142,11 +452,119 @@ class DjangoModelResource(BaseModelResource):
             if filter_q_object:
                 qs = qs.filter(filter_q_object)
             else:
-                qs = qs.filter(**self.process_lookups(lookups))
+                qs = qs.filter(**self.filter_lookups(lookups))
+        except (FieldError, QueryError), err:
+            raise Bubbler(EmittableResponse(str(err), status=400))
+
+        return qs, ordering
+
+    def check_indexes(self, ordering, conditions):
+        """
+        Checks the ordering and conditions against the model's indexes, and
+        applies the resource's `unindexed_query_policy` to queries that use
+        unindexed columns.
+        
+        """
+        paths = []
+        for o in ordering or ():
+            try:
+                field, joins, indexed = self.translator.resolve_path(
+                    o.lstrip('-'))
+            except QueryError:
+                # Unknown fields are reported by the ORM.
+                continue
+            if not indexed and o.lstrip('-') not in paths:
+                paths.append(o.lstrip('-'))
+        shape = ''
+        if conditions:
+            template, cost, unindexed = self.translator.get_compiled(conditions)
+            paths.extend([p for p in unindexed if p not in paths])
+            shape = self.translator.describe(template)
+
+        if not paths:
+            return
+        if self.unindexed_query_policy == 'reject':
+            raise Bubbler(EmittableResponse("This model cannot be ordered or "
+                "filtered by the unindexed field(s) %s." % ', '.join(paths),
+                status=400))
+
+        logger.warning("Query on %s uses the unindexed field(s) %s (ordering: "
+            "%r, conditions: %r)" % (self.url_prefix, ', '.join(paths),
+            ordering, conditions))
+        record_unindexed_query(self, ordering, shape, paths)
+
+    def get_slice(self, lookups):
+        """Pops the offset and limit arguments from the given lookups."""
+        offset = int(iterable(lookups.pop('offset', 0)))
+        limit = min(int(iterable(lookups.pop('limit', self.max_objects))), int(iterable(self.max_objects)))
+        return offset, limit
+
+    def list(self, request):
+        lookups = request.GET.copy()
+
+        # Passing a cursor (even an empty one, for the first page) switches
+        # the list over to keyset pagination.
+        cursor = iterable(lookups.pop('cursor', None))
+        offset, limit = self.get_slice(lookups)
+
+        qs, ordering = self.filter_query_set(request, lookups)
+
+        if cursor is not None:
+            return self.list_by_cursor(qs, ordering, cursor, limit)
+        
+        qs = qs[offset:offset + limit]
+        if self.stream_chunk_size:
+            # Serialize the page while the request's transaction is still
+            # open; only the encoding is left for when the response is sent.
+            plan = self.serialization_plan
+            records = list(self.serialize_query_set(qs))
+            return StreamingResponse(records,
+                chunk_size=self.stream_chunk_size,
+                clean=plan is not None and plan.clean)
+        return qs
+
+    def page(self, request):
+        """
+        Returns a page of objects along with the total number of objects
+        matching the request, saving the client a separate length/ call
+        with the same conditions.
+        
+        """
+        lookups = request.GET.copy()
+        offset, limit = self.get_slice(lookups)
+
+        qs, ordering = self.filter_query_set(request, lookups)
+
+        plan = self.serialization_plan
+        records = list(self.serialize_query_set(qs[offset:offset + limit]))
+        return EmittableResponse({'records': records, 'length': self.count(qs)},
+            clean=plan is not None and plan.clean)
+
+    def list_by_cursor(self, qs, ordering, cursor, limit):
+        """
+        Returns the page of objects following the given cursor, along with
+        the cursor for the next page (or None, if this is the last page).
+        
+        """
+        try:
+            ordering = keyset_ordering(self.model, ordering)
+            qs = qs.order_by(*ordering)
+            if cursor:
+                values = decode_cursor(cursor, self.model, ordering)
+                qs = qs.filter(seek_filter(ordering, values))
+            objects = list(qs[:limit])
+        except InvalidCursor, err:
+            return EmittableResponse(str(err), status=400)
         except FieldError, err:
             return EmittableResponse(str(err), status=400)
-        
-        return qs[offset:offset + limit]
+
+        next = None
+        if objects and len(objects) == limit:
+            next = encode_cursor(cursor_values(objects[-1], ordering))
+        plan = self.serialization_plan
+        records = self.serialize_models(objects)
+        return EmittableResponse({'records': records, 'next': next},
+            clean=plan is not None and plan.clean)
 
     def show(self, request):
         pk_list = request.GET.getlist('pk')
@@ -155,9 +573,51 @@ class DjangoModelResource(BaseModelResource):
             return EmittableResponse("The request must specify a pk argument",
                 status=400)
                     
+        if self.object_cache_timeout and self.serialization_plan:
+            return self.show_cached(request, pk_list)
+
         qs = self.get_query_set(request)
         return qs.filter(pk__in=pk_list)    
 
+    def show_cached(self, request, pk_list):
+        """
+        Returns the objects with the given primary keys, in the order they
+        were requested. Objects are read from the object cache, and only the
+        ones that aren't cached are fetched from the database (and cached).
+        
+        The cache is shared by every request, so the primary keys are first
+        checked against `get_query_set`, which may hide objects from some
+        requests (e.g. by `user_field_name`).
+        
+        """
+        try:
+            pk_field = self.model._meta.pk
+            pks = []
+            for pk in map(pk_field.to_python, pk_list):
+                if pk not in pks:
+                    pks.append(pk)
+        except ValidationError:
+            return EmittableResponse("The pk arguments sent in the request "
+                "were malformed", status=400)
+
+        qs = self.get_query_set(request)
+        visible = set(qs.filter(pk__in=pks).values_list('pk', flat=True))
+        pks = [pk for pk in pks if pk in visible]
+
+        plan = self.serialization_plan
+        records = get_cached_objects(self.model, plan.signature, pks)
+        missing = [pk for pk in pks if pk not in records]
+        if missing:
+            qs = qs.filter(pk__in=missing)
+            fresh = dict([(pk_field.to_python(record['pk']), record)
+                for record in self.serialize_query_set(qs)])
+            set_cached_objects(self.model, plan.signature, fresh,
+                self.object_cache_timeout)
+            records.update(fresh)
+
+        return EmittableResponse([records[pk] for pk in pks if pk in records],
+            clean=plan.clean)
+
     def create(self, request):
         data = request.data
         
@@ -203,11 +663,166 @@ class DjangoModelResource(BaseModelResource):
                 status=400)
         
         qs = self.get_query_set(request)
-        
-        # QUESTION: Should we delete in bulk or loop through and delete?
-        qs.filter(pk__in=pk_list).delete()
+        try:
+            self.delete_objects(qs.filter(pk__in=pk_list))
+        except (ValueError, ValidationError):
+            return EmittableResponse("The pk arguments sent in the request "
+                "were malformed", status=400)
         
         return HttpResponse('', status=204)    
 
+    def delete_objects(self, qs, strategy=None):
+        """
+        Deletes the objects in the given QuerySet using the given strategy,
+        which defaults to the resource's `destroy_strategy`, and logs how
+        long it took.
+        
+        """
+        strategy = strategy or self.destroy_strategy
+        start = time.time()
+        if strategy == 'collector':
+            # Newer versions of Django return the number of deleted objects.
+            count = (qs.delete() or (None,))[0]
+        else:
+            pk_list = list(qs.values_list('pk', flat=True))
+            count = len(pk_list)
+            if strategy == 'raw':
+                raw_delete(self.model, pk_list, qs.db)
+                # No signals were sent, so we invalidate the caches ourselves.
+                bump_model_version(self.model)
+                invalidate_objects(self.model, pk_list)
+            else:
+                atomic = getattr(transaction, 'atomic',
+                    transaction.commit_on_success)
+                for chunk in chunks(pk_list, self.destroy_chunk_size):
+                    with atomic(using=qs.db):
+                        self.model._default_manager.filter(pk__in=chunk) \
+                          .delete()
+        logger.info("Destroyed %s %s object(s) from %s using the %s strategy "
+            "in %.3f seconds" % (count is None and 'the' or count,
+            self.model.__name__, self.url_prefix, strategy,
+            time.time() - start))
+
+    def batch(self, request):
+        """
+        Applies a list of create, update and destroy operations, e.g.
+        
+            [{"op": "create", "data": {...}},
+             {"op": "update", "pk": 1, "data": {...}},
+             {"op": "destroy", "pk": 2}]
+        
+        Every operation is validated before any of them is applied, and they
+        are applied in a single transaction, so either all of them succeed or
+        none of them do. The response holds one result per operation. Since
+        the operations are validated against the objects as they were before
+        the batch, each object can only be updated or destroyed once per batch.
+        
+        JSON batches are decoded one operation at a time, so that oversized
+        or malformed batches are rejected without decoding all of them.
+        
+        """
+        operations = []
+        for op in mimer.iter_records(request):
+            if not isinstance(op, dict):
+                return EmittableResponse("The data sent in the request was "
+                    "malformed", status=400)
+            if len(operations) == self.max_batch_size:
+                return EmittableResponse("A batch cannot contain more than "
+                    "%d operations." % self.max_batch_size, status=400)
+            operations.append(op)
+
+        # The batch is checked as a POST request, so check the permissions
+        # its updates and deletions need as well.
+        auth = self.authenticator
+        actions = set([{'create': 'add', 'update': 'change',
+            'destroy': 'delete'}.get(op.get('op')) for op in operations])
+        actions.discard(None)
+        if getattr(auth, 'admin_perms_required', False) and \
+          not auth.has_admin_perms(request, sorted(actions)):
+            return EmittableResponse("", status=403)
+
+        # Fetch the objects to update or destroy in a single query.
+        pk_field = self.model._meta.pk
+        pks = []
+        for op in operations:
+            try:
+                pks.append(pk_field.to_python(op.get('pk')))
+            except ValidationError:
+                pks.append(None)
+        instances = self.get_query_set(request).in_bulk([pk for op, pk in
+            zip(operations, pks) if pk is not None and
+            op.get('op') in ('update', 'destroy')])
+
+        results, forms, failed, seen = [], [], False, set()
+        for op, pk in zip(operations, pks):
+            kind, data = op.get('op'), op.get('data')
+            form, result = None, {'status': 424} # Failed dependency, if the
+                                                 # batch is rejected.
+            if kind not in ('create', 'update', 'destroy'):
+                result = {'status': 400, 'errors': "Unknown operation %r. "
+                    "Use create, update or destroy." % kind}
+            elif kind != 'create' and pk not in instances:
+                result = {'status': 404, 'errors': "No object with the pk %r "
+                    "exists" % op.get('pk')}
+            elif kind != 'create' and pk in seen:
+                result = {'status': 400, 'errors': "The object with the pk %r "
+                    "is already changed by another operation of the batch" %
+                    op.get('pk')}
+            elif kind == 'destroy':
+                form = instances[pk]
+                seen.add(pk)
+            elif not isinstance(data, dict):
+                result = {'status': 400, 'errors': "The data of the "
+                    "operation was malformed"}
+            else:
+                instance = None
+                if kind == 'update':
+                    instance = instances[pk]
+                    seen.add(pk)
+                form = self.form(data, instance=instance)
+                if form.errors:
+                    result = {'status': 400, 'errors': form.errors}
+                    form = None
+            failed = failed or form is None
+            results.append(result)
+            forms.append((kind, form))
+
+        if failed:
+            return EmittableResponse(results, status=400)
+
+        atomic = getattr(transaction, 'atomic', transaction.commit_on_success)
+        with atomic(using=self.model._default_manager.db):
+            objects = self.apply_batch(forms)
+
+        for kind, result, obj in zip([k for k, f in forms], results, objects):
+            result['status'] = kind == 'destroy' and 204 or 200
+            if obj is not None:
+                result['record'] = self.serialize_models(obj)
+        return EmittableResponse(results)
+
+    def apply_batch(self, forms):
+        """
+        Applies the given list of validated (operation, form) tuples, where
+        the form of destroy operations is the instance to delete. Returns the
+        saved object for each create and update operation, and None for each
+        destroy operation.
+        
+        """
+        manager = self.model._default_manager
+        objects, deleted = [], []
+        for kind, form in forms:
+            if kind == 'destroy':
+                deleted.append(form.pk)
+                objects.append(None)
+            else:
+                objects.append(form.save())
+
+        if deleted:
+            # The batch has its own transaction, so chunking wouldn't help.
+            strategy = self.destroy_strategy
+            self.delete_objects(manager.filter(pk__in=deleted),
+                strategy == 'chunked' and 'collector' or strategy)
+        return objects
+
 # Alias to make importing easier, while retaining the class's full name.
 ModelResource = DjangoModelResource
\ No newline at end of file
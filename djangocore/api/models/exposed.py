@@ -0,0 +1,109 @@
+"""
+Caching for the results of exposed methods, declared with the `cache`
+option of the `expose` decorator:
+
+    @expose(cache='request', ...)  # Once per object and request.
+    @expose(cache='ttl:300', ...)  # For 300 seconds.
+    @expose(cache='version', ...)  # Until an instance of the model is saved
+                                   # or deleted.
+
+Results are memoized for the current request in every scope, and the
+`ttl` and `version` scopes keep them in a cache backend as well. This is
+Django's cache by default; set SPROUTCORE_EXPOSED_CACHE to the dotted
+path of another object with the same `get` and `set` methods, or call
+`set_cache_backend`.
+
+"""
+# Django dependencies.
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.encoding import smart_str
+from django.utils.importlib import import_module
+
+# Intra-app dependencies.
+from djangocore.api.utils import request_memo
+from djangocore.api.models.versions import track_model, get_model_version
+from djangocore.utils import deconstruct
+
+_backend = None
+_missing = object()
+
+def get_cache_backend():
+    global _backend
+    if _backend is None:
+        path = getattr(settings, 'SPROUTCORE_EXPOSED_CACHE', None)
+        if path:
+            module, attr = path.rsplit('.', 1)
+            _backend = getattr(import_module(module), attr)
+        else:
+            from django.core.cache import cache
+            _backend = cache
+    return _backend
+
+def set_cache_backend(backend):
+    """Sets the backend to cache results in. None restores the default."""
+    global _backend
+    _backend = backend
+
+def parse_scope(scope):
+    """
+    Returns a (scope, timeout) tuple for the given `cache` option, raising
+    ImproperlyConfigured for unknown scopes.
+
+    """
+    if scope in ('request', 'version'):
+        return scope, None
+    if scope.startswith('ttl:'):
+        try:
+            return 'ttl', int(scope[4:])
+        except ValueError:
+            pass
+    raise ImproperlyConfigured("Unknown exposed method cache %r. Use "
+        "'request', 'version' or 'ttl:<seconds>'." % scope)
+
+def cached_method(model, name, method):
+    """
+    Wraps the given exposed method of the given model in a function which
+    caches its (deconstructed) results according to the method's `cache`
+    option.
+
+    """
+    scope, timeout = parse_scope(method.cache)
+    if scope == 'version':
+        track_model(model)
+    opts = model._meta
+    prefix = 'djangocore:exposed:%s.%s:%s' % (opts.app_label,
+        opts.module_name, name)
+
+    def call(obj):
+        key = '%s:%s' % (prefix, smart_str(obj._get_pk_val()))
+        memo = request_memo()
+        value = memo.get(key, _missing)
+        if value is not _missing:
+            return value
+
+        version = None
+        if scope == 'version':
+            # Look the version up once per request, not once per object.
+            version = memo.get(prefix, _missing)
+            if version is _missing:
+                version = memo[prefix] = get_model_version(model)
+
+        if scope == 'request' or (scope == 'version' and version is None):
+            # Without a version, results can only be kept for the request.
+            value = deconstruct(method(obj))
+        else:
+            backend_key = key
+            if scope == 'version':
+                backend_key = '%s:%s' % (key, version)
+            backend = get_cache_backend()
+            value = backend.get(backend_key, _missing)
+            if value is _missing:
+                value = deconstruct(method(obj))
+                backend.set(backend_key, value, timeout)
+        memo[key] = value
+        return value
+
+    # Keep the `expose` options (e.g. `sd_depends`) around.
+    call.__dict__.update(getattr(method, 'im_func', method).__dict__)
+    return call
@@ -0,0 +1,49 @@
+"""
+Bookkeeping for queries that order or filter on unindexed columns.
+
+Resources with an `unindexed_query_policy` of 'warn' log every such query
+and record its shape (the ordering plus the conditions with their values
+left out) in Django's cache, where the `scindexes` management command can
+report on them later. Use a shared cache backend to collect observations
+from all processes.
+
+Observations are only meant to point at missing indexes: concurrent
+requests may overwrite each other's counts, and shapes beyond the first
+`max_shapes` of each resource aren't recorded.
+
+"""
+import logging
+
+# Django dependencies.
+from django.core.cache import cache
+
+logger = logging.getLogger('djangocore.api')
+
+observation_timeout = 60 * 60 * 24 * 7 # Keep observations around for a week.
+max_shapes = 100 # The most query shapes to record for each resource.
+
+def observation_key(resource):
+    return 'djangocore:unindexed:%s' % resource.url_prefix
+
+def record_unindexed_query(resource, ordering, conditions, paths):
+    """
+    Counts one more occurrence of the given query shape, where
+    `conditions` is the described (value agnostic) conditions.
+    
+    """
+    shape = (tuple(ordering or ()), conditions or '', tuple(paths))
+    key = observation_key(resource)
+    observations = cache.get(key) or {}
+    if shape not in observations and len(observations) >= max_shapes:
+        return
+    observations[shape] = observations.get(shape, 0) + 1
+    cache.set(key, observations, observation_timeout)
+
+def get_unindexed_queries(resource):
+    """
+    Returns a list of ((ordering, conditions, paths), count) tuples for
+    the given resource, most frequent first.
+
+    """
+    observations = cache.get(observation_key(resource)) or {}
+    return sorted(observations.items(), key=lambda item: -item[1])
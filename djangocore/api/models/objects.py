@@ -0,0 +1,128 @@
+"""
+A read-through cache of serialized model instances.
+
+Every object is cached under its model, its primary key and the signature
+of the serialization plan that produced it, so that resources exposing
+different fields of the same model never see each other's records. The
+entries of a single object are deleted whenever it is saved or deleted,
+whenever its many to many relations change, or whenever an object it
+depends on (through the `sd_depends` of exposed methods) is saved or
+deleted.
+
+Writes that don't send signals (`QuerySet.update`, raw SQL) are not seen,
+and neither are changes to objects that exposed methods read without
+naming them in `sd_depends`, so resources that rely on those should keep
+the cache disabled.
+
+"""
+# Django dependencies.
+from django.core.cache import cache
+from django.db.models import signals
+from django.utils.encoding import smart_str
+
+# Maps each tracked model to the set of plan signatures it is cached under.
+_signatures = {}
+
+def object_key(model, signature, pk):
+    opts = model._meta
+    return 'djangocore:object:%s.%s:%s:%s' % (opts.app_label,
+        opts.module_name, signature, smart_str(pk))
+
+def get_cached_objects(model, signature, pks):
+    """
+    Returns a dictionary mapping the given primary keys to their cached
+    records. Primary keys that aren't cached are left out.
+
+    """
+    keys = dict([(object_key(model, signature, pk), pk) for pk in pks])
+    return dict([(keys[key], record) for key, record in
+        cache.get_many(keys.keys()).items()])
+
+def set_cached_objects(model, signature, records, timeout):
+    """Caches the given dictionary of primary keys to records."""
+    cache.set_many(dict([(object_key(model, signature, pk), record)
+        for pk, record in records.items()]), timeout)
+
+def invalidate_objects(model, pks):
+    """Deletes the cached records of the given objects, for every plan."""
+    keys = [object_key(model, signature, pk) for pk in pks
+        for signature in _signatures.get(model, ())]
+    if keys:
+        cache.delete_many(keys)
+
+def _invalidate_instance(sender, instance, **kwargs):
+    invalidate_objects(sender, [instance.pk])
+
+def _invalidate_relation(field):
+    """
+    Returns a m2m_changed handler for the given many to many field, which
+    invalidates the objects on the field's side of the relation.
+
+    """
+    model = field.model
+    source, target = field.m2m_field_name(), field.m2m_reverse_field_name()
+
+    def invalidate(sender, instance, action, reverse, pk_set, **kwargs):
+        if not reverse:
+            if action.startswith('post_'):
+                invalidate_objects(model, [instance.pk])
+        elif action == 'pre_clear':
+            # The related objects are gone once the relation is cleared.
+            pks = sender._default_manager.filter(**{target: instance}) \
+                .values_list(source, flat=True)
+            invalidate_objects(model, list(pks))
+        elif action.startswith('post_') and pk_set:
+            invalidate_objects(model, pk_set)
+    return invalidate
+
+def _invalidate_dependents(model, path):
+    """
+    Returns a post_save and pre_delete handler for the model at the end of
+    the given relation path, which invalidates the objects of `model` that
+    are related to the saved or deleted instance.
+
+    """
+    def invalidate(sender, instance, **kwargs):
+        pks = model._default_manager.filter(**{path: instance.pk}) \
+            .values_list('pk', flat=True)
+        invalidate_objects(model, list(pks))
+    return invalidate
+
+def _related_model(model, path):
+    """Returns the model at the end of the given relation path."""
+    for name in path.split('__'):
+        field, m, direct, m2m = model._meta.get_field_by_name(name)
+        if direct:
+            model = field.rel.to
+        else:
+            model = field.model
+    return model
+
+def track_objects(model, signature, depends=()):
+    """
+    Connects the signal handlers which delete an object's cached records
+    when it changes, or when an object at the end of one of the relation
+    paths in `depends` changes. Safe to call more than once.
+
+    """
+    _signatures.setdefault(model, set()).add(signature)
+
+    opts = model._meta
+    uid = 'djangocore:object:%s.%s' % (opts.app_label, opts.module_name)
+    signals.post_save.connect(_invalidate_instance, sender=model,
+        dispatch_uid=uid)
+    signals.post_delete.connect(_invalidate_instance, sender=model,
+        dispatch_uid=uid)
+    for field in opts.many_to_many:
+        through = field.rel.through
+        if through._meta.auto_created:
+            signals.m2m_changed.connect(_invalidate_relation(field),
+                sender=through, dispatch_uid='%s:%s' % (uid, field.name),
+                weak=False)
+    for path in depends:
+        handler = _invalidate_dependents(model, path)
+        related = _related_model(model, path)
+        signals.post_save.connect(handler, sender=related,
+            dispatch_uid='%s:%s' % (uid, path), weak=False)
+        signals.pre_delete.connect(handler, sender=related,
+            dispatch_uid='%s:%s' % (uid, path), weak=False)
@@ -1,5 +1,11 @@
 import re
+from django.core.exceptions import ValidationError
 from django.db.models import Q
+from django.db.models.fields import FieldDoesNotExist
+from django.db.models.sql.constants import QUERY_TERMS
+from django.utils.encoding import force_unicode
+
+from djangocore.utils import LRUCache
 
 """
   This module offers a translator object that takes simple sproutcore queries and
@@ -12,42 +18,247 @@ from django.db.models import Q
   - CocoPy
 
   But these are a bit of an overload for an engine that has to parse all client queries
-  that come into the server. Also, the sproutcore sql syntax is rather limited and simple 
+  that come into the server. Also, the sproutcore sql syntax is rather limited and simple
   too which makes it not too difficult to implement a library for it.
-  Finally, using these libraries would only result in a parsed token-tree that still has to be 
+  Finally, using these libraries would only result in a parsed token-tree that still has to be
   evaluated into a django tree.
-  Given that, I deemed it easier to write a simple parser & tokenizer based on a couple of regular expressions
-  to achieve something close to a full recursive descent parser.
+
+  Queries are therefore handled in three small steps:
+  - a single pass lexer splits the query into tokens
+  - a recursive descent parser turns the tokens into a tree (see below), honouring
+    operator precedence (NOT binds tighter than AND, which binds tighter than OR),
+    parentheses and NOT
+  - the tree is lowered into a django Q object, substituting the query parameters
+
+  Both the lexer and the parser only look at each token once, so parsing takes time
+  linear in the length of the query.
+
+  The tree is made up of tuples:
+  ('or', [children]), ('and', [children]), ('not', child),
+  ('cmp', field, operator, value), where operator is a django lookup type (prefixed
+  with ~ when it has to be inverted) and value is one of ('literal', value),
+  ('param', name) or ('list', [values])
+
+  When the translator knows the model being queried, each field name is resolved
+  against the model's _meta while compiling, which appends the model field to the
+  'cmp' tuple, and values are converted with that field's to_python.
+
+  Every compiled query is also given a cost, so that overly expensive queries can be
+  rejected before they reach the database. Each comparison costs the cost of its
+  operator plus join_cost for every join it needs, multiplied by unindexed_factor
+  when the compared column has no index the database could use for it.
 """
 
-c_and = "and"
-c_or = "or"
-c_not = "not"
+class QueryError(ValueError):
+  """
+    Raised when a query can't be translated. The message is meant for the client.
+  """
+  pass
+
+class QuerySyntaxError(QueryError):
+  pass
+
+class QueryFieldError(QueryError):
+  pass
+
+class QueryCostError(QueryError):
+  pass
+
+"""lookups that compare against (parts of) strings, whatever the field type"""
+text_lookups = ("contains", "startswith", "endswith", "regex")
+
+"""the keywords that can't be used as field names"""
+keywords = ("and", "or", "not", "begins_with", "ends_with", "contains", "matches",
+  "any", "in", "true", "false", "yes", "no", "null")
+
+"""literal keywords and their python values"""
+constants = {"true": True, "false": False, "yes": True, "no": False, "null": None}
 
-class logic_expression(object):
+whitespace_expression = re.compile(r"\s*")
+
+token_expression = re.compile(r"""
+  (?P<string>'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")|  # 'Douglas Adams' or "Douglas Adams"
+  (?P<param>\{\s*[a-zA-Z_][a-zA-Z0-9_]*\s*\})|       # {parameter}
+  (?P<number>-?[0-9]+(?:\.[0-9]+)?)|               # 42 or 4.2
+  (?P<op><=|>=|!=|=|<|>)|                          # comparison operators
+  (?P<word>[a-zA-Z_][a-zA-Z0-9_.]*)|               # field names and keywords
+  (?P<lparen>\()|
+  (?P<rparen>\))|
+  (?P<comma>,)
+""", re.VERBOSE|re.DOTALL)
+
+escape_expression = re.compile(r"\\(.)", re.DOTALL)
+
+def tokenize(query):
+  """
+    Splits the query into a list of (kind, text, position) tuples.
   """
-    A small helper entity that keeps track of a current expression
+  tokens = []
+  pos, end = 0, len(query)
+  while True:
+    pos = whitespace_expression.match(query, pos).end()
+    if pos >= end:
+      break
+    m = token_expression.match(query, pos)
+    if m is None:
+      raise QuerySyntaxError("Unexpected character %r at position %d of the "
+        "conditions" % (query[pos], pos))
+    tokens.append((m.lastgroup, m.group(m.lastgroup), pos))
+    pos = m.end()
+  return tokens
+
+class parser(object):
+  """
+    A recursive descent parser for sproutcore queries:
+
+    expression := term (OR term)*
+    term       := factor (AND factor)*
+    factor     := NOT* (( expression ) | comparison)
+    comparison := field operator value
+    value      := string | number | parameter | constant | ( value (, value)* )
   """
-  has_and = False
-  has_or = False
-  has_not = False
-  def __init__(self, list):
-    for l in list:
-      l = l.lower()
-      if l==c_and:
-        self.has_and = True
-      elif l==c_or:
-        self.has_or = True
-      elif l==c_not:
-        self.has_not = True
+
+  """the maximum nesting of parentheses, to keep the recursion bounded"""
+  max_depth = 32
+
+  def __init__(self, tokens, operators):
+    self.tokens = tokens
+    self.operators = operators
+    self.pos = 0
+    self.depth = 0
+
+  def error(self, message):
+    if self.pos < len(self.tokens):
+      position = "at position %d" % self.tokens[self.pos][2]
+    else:
+      position = "at the end"
+    raise QuerySyntaxError("%s %s of the conditions" % (message, position))
+
+  def peek(self):
+    if self.pos < len(self.tokens):
+      return self.tokens[self.pos]
+    return (None, None, None)
+
+  def next(self):
+    token = self.peek()
+    if token[0] is None:
+      self.error("Unexpected end")
+    self.pos += 1
+    return token
+
+  def accept(self, kind):
+    if self.peek()[0]==kind:
+      return self.next()
+    return None
+
+  def accept_keyword(self, keyword):
+    kind, text, pos = self.peek()
+    if kind=="word" and text.lower()==keyword:
+      return self.next()
+    return None
+
+  def parse(self):
+    if not self.tokens:
+      return None
+    node = self.parse_expression()
+    if self.pos < len(self.tokens):
+      self.error("Unexpected %r" % self.peek()[1])
+    return node
+
+  def parse_expression(self):
+    children = [self.parse_term()]
+    while self.accept_keyword("or"):
+      children.append(self.parse_term())
+    if len(children)==1:
+      return children[0]
+    return ("or", children)
+
+  def parse_term(self):
+    children = [self.parse_factor()]
+    while self.accept_keyword("and"):
+      children.append(self.parse_factor())
+    if len(children)==1:
+      return children[0]
+    return ("and", children)
+
+  def parse_factor(self):
+    #NOT chains are folded here, rather than by recursing once for each NOT
+    negated = False
+    while self.accept_keyword("not"):
+      negated = not negated
+
+    if self.accept("lparen"):
+      self.depth += 1
+      if self.depth > self.max_depth:
+        self.error("Too many nested parentheses")
+      node = self.parse_expression()
+      if not self.accept("rparen"):
+        self.error("Expected ')'")
+      self.depth -= 1
+    else:
+      node = self.parse_comparison()
+
+    if negated:
+      return ("not", node)
+    return node
+
+  def parse_comparison(self):
+    kind, text, pos = self.peek()
+    if kind!="word" or text.lower() in keywords:
+      self.error("Expected a field name")
+    self.next()
+
+    #if the field contains dots, these have to be converted to __ as that is the django field seperator
+    field = text.replace(".", "__")
+    operator = self.parse_operator()
+    value = self.parse_value()
+    return ("cmp", field, operator, value)
+
+  def parse_operator(self):
+    kind, text, pos = self.peek()
+    if kind=="op":
+      name = text
+    elif kind=="word":
+      name = text.lower()
+      if name=="not":
+        self.next()
+        kind, text, pos = self.peek()
+        if kind!="word":
+          self.error("Expected an operator")
+        name = "not " + text.lower()
+    else:
+      name = None
+    if name not in self.operators:
+      self.error("Expected an operator")
+    self.next()
+    return self.operators[name]
+
+  def parse_value(self, allow_list=True):
+    kind, text, pos = self.next()
+    if kind=="string":
+      return ("literal", escape_expression.sub(r"\1", text[1:-1]))
+    elif kind=="number":
+      if "." in text:
+        return ("literal", float(text))
+      return ("literal", int(text))
+    elif kind=="param":
+      return ("param", text[1:-1].strip())
+    elif kind=="word" and text.lower() in constants:
+      return ("literal", constants[text.lower()])
+    elif kind=="lparen" and allow_list:
+      values = [self.parse_value(False)]
+      while self.accept("comma"):
+        values.append(self.parse_value(False))
+      if not self.accept("rparen"):
+        self.error("Expected ')'")
+      return ("list", values)
+    self.pos -= 1
+    self.error("Expected a value")
 
 class translator(object):
-  
+
   #todo:
-  # - Support for NOT (not and, not or, not in, not contains, etc)
-  # - Support for parenthsis for grouping
   # - Support for contains to understand whether it is a string or a colleciton
-  # - support for in / any collections
 
   """
   http://docs.sproutcore.com/symbols/SC.Query.html#constructor
@@ -74,11 +285,11 @@ class translator(object):
   Boolean Operators:
   AND
   OR
-  *NOT
+  NOT
   Parenthesis for grouping:
-  *( and )
+  ( and )
   """
-  
+
   django_operators = {
     "begins_with":"startswith", #or istartswith
     "ends_with": "endswith", #or iendswith
@@ -87,6 +298,7 @@ class translator(object):
     "contains": "contains", #or contains, if the right parm is a string, not a collection
     "not contains": "~contains",
     "matches": "regex", #or iregex
+    "not matches": "~regex",
     "any": "in",
     "not any": "~in",
     "=": "exact", #or iexact
@@ -97,79 +309,51 @@ class translator(object):
     "<=": "lte",
     "in": "in",
     "not in": "~in",
-    "not": "not"
   }
-  
-  stack = []
-  
-  """this expression finds the expression blocks in the whole statement"""
-  big_block_expression = None
-
-  """this expression finds field, operator, and value in one expression-block """
-  small_block_expression = None
-  
-  """
-    The init function compiles the regular expressions that are used to identify the blocks 
-  """
-  def __init__(self):
-    """
-      This expression matches actually one block expression in our statement. 
-      I.e. in the query "where name_field = 'Douglas Adams' and age>42" it would return
-      two matches: "name_field = 'Douglas Adams'"  and  "age<42"
-    """
-    ex1 = """       # (name_field = 'Douglas Adams' and not)
-    [a-zA-Z\_\.]+       # Name of the Column that is to be queried
-                # name_field
-    \s?           # Optional whitespace between the Column and the operator
-    (?:%s)          # The list of operators (from django_operators) joined by a bitwise or (|)
-                # =
-    .*?           # Any whitespace and the value of the expression
-                # 'Douglas Adams'
-    (?:%s|$)+       # List of logical operations (and, or, not) as well as the end of the file
-                # 'and'
-    \s?           # Optional whitespace
-    (?:%s|$)?       # Another logical operation to also match (and not, or not, not and, not or)
-                # 'not'
-    """ % (self.operatorstring(), self.logicstring(), self.logicstring())
-    
-    """
-      This expression matches the different parts in one block expression.
-      I.e. in the expression 'name_field = 'Douglas Adams' it would return
-      three matches: "name_field", "=", and "Douglas Adams"
-    """
-    ex2 = """
-    ([a-zA-Z\_\.]+)     # The Name of the Column, this is group match 1
-                # 'name_field'
-    \s?           # Optional whitespace
-    (%s)          # The operator, this is group match 2
-                # '='
-    \s?           # Optional whitespace
-                # The value of the expression
-                # 'Douglas Adams'
-    (\'.*?\'|         # String value
-    \{.*?\}|        # A parameter value
-    [0-9]+|         # A Number value (currently, int only)
-    \(.*?\))        # A in or any value
-    """ % (self.operatorstring(),)
-    
-    self.big_block_expression = re.compile(ex1, re.IGNORECASE|re.DOTALL|re.VERBOSE)
-    self.small_block_expression = re.compile(ex2, re.IGNORECASE|re.DOTALL|re.VERBOSE)
-  
-  """
-    A couple of helper functions that comb through our operator dictionaries 
-  """
-  def logiclist(self):
-    return (c_and, c_or, c_not)
-  
-  def logicstring(self):
-    return "|".join(self.logiclist())
-  
-  def operatorlist(self):
-    return [re.escape(f) for f in self.django_operators.keys()]
-  
-  def operatorstring(self):
-    return "|".join(self.operatorlist())
-  
+
+  """the number of compiled query templates to keep around"""
+  template_cache_size = 128
+
+  """the cost of each lookup type; regular expressions and substring searches
+  can't use an index, so they cost more. case insensitive lookups cost as much
+  as their case sensitive counterparts (and can't use an index either)"""
+  operator_costs = {
+    "exact": 1,
+    "iexact": 1,
+    "in": 1,
+    "lt": 1,
+    "gt": 1,
+    "lte": 1,
+    "gte": 1,
+    "range": 1,
+    "isnull": 1,
+    "startswith": 2,
+    "istartswith": 2,
+    "endswith": 5,
+    "iendswith": 5,
+    "contains": 5,
+    "icontains": 5,
+    "regex": 10,
+    "iregex": 10,
+    "search": 10,
+  }
+
+  """the cost of lookup types missing from operator_costs"""
+  unknown_operator_cost = 10
+
+  """lookup types that can make use of an index on the column"""
+  indexable_lookups = ("exact", "in", "lt", "gt", "lte", "gte", "startswith")
+
+  join_cost = 2
+  unindexed_factor = 4
+
+  def __init__(self, model=None, max_cost=None):
+    self.model = model
+    self.max_cost = max_cost
+    self.templates = LRUCache(self.template_cache_size)
+    #the resolved (field, joins, indexed) tuples, by field path
+    self.paths = {}
+
   def parse(self, query, parameters = {}):
     """
       This function receives a sproutcore query and optional parameters,
@@ -178,117 +362,307 @@ class translator(object):
     """
 
     #if the query is empty, return an empty obj
-    if len(query.strip())=="":
+    if len(query.strip())==0:
       return None
 
-    self.stack = []
-    
-    ##first step, break into AND, or OR blocks
-    m = self.big_block_expression.findall(query)
-
-    #if there were no blocks, return none
-    if m==None or len(m)==0:return None
-    
-    #No loop through the blocks and try to identify the parts
-    for exp in m:
-      if exp.strip()=="":continue
-      
-      #parse the individual group
-      m = self.small_block_expression.search(exp)
-      if m:
-        if len(m.groups())==3:
-          self.stack.append(m.groups())
-      combinatorList = re.findall("(?:%s)+$" % (self.logicstring()), exp.strip(), re.IGNORECASE)
-      if combinatorList != None:
-        self.stack.append(combinatorList)
-    
-    #The main Q object
-    obj = None
-    combinator = None #the current logical combination expression
-
-    def convert_value(value):
-      """
-        Convert the value that comes in as string to
-        the right python datatype.
-        Currently supports conversion to 
-        int, string, tuple
-      """
-      #TODO: Use the Django Type Information from the model to
-      #convert these to the right datatype (i.e. date, etc)
-
-      #If we have a non-string alredy, return it
-      if type(value)!=type(""):return value
-
-      value = value.replace("'", "")
-      
-      #this is a number value
-      if re.match("^[0-9]+$", value):
-        return int(value)
-      #this is a collection. we could also match against \(.*?\) but that takes longer and the solution below should suffice
-      elif value[0]=="(":
-        return [convert_value(x.strip()) 
-              for x in tuple(value[1:-1].split(','))] #recursive list comprehension ftw.
-      #string
+    #clients only send a handful of query shapes with differing parameters, so
+    #the parsed (parameter agnostic) template is cached by the query string
+    template, cost, unindexed = self.get_compiled(query)
+    self.check_cost(cost)
+
+    return self.bind(template, parameters)
+
+  def check_cost(self, cost):
+    """
+      Raises QueryCostError if the given cost is more than max_cost allows.
+    """
+    if self.max_cost is not None and cost > self.max_cost:
+      raise QueryCostError("The conditions are too expensive to run (a cost "
+        "of %d, where at most %d is allowed)" % (cost, self.max_cost))
+
+  def compile_lookups(self, lookups):
+    """
+      Builds a template for django lookup arguments (e.g. "poll__slug" or
+      "answer__regex"), so that plain lookups can be costed like queries.
+      The values are left out, since they don't affect the cost.
+    """
+    children = []
+    for key in lookups:
+      names = key.split("__")
+      lookup = "exact"
+      if len(names) > 1 and names[-1] in QUERY_TERMS:
+        lookup = names.pop()
+      children.append(("cmp", "__".join(names), lookup, ("param", key)))
+    return children and ("and", children) or None
+
+  def get_compiled(self, query):
+    """
+      Returns a (template, cost, unindexed paths) tuple for the query,
+      compiling it unless it is cached already.
+    """
+    compiled = self.templates.get(query)
+    if compiled is None:
+      template = self.compile(query)
+      compiled = (template, self.cost(template), self.unindexed_paths(template))
+      self.templates.set(query, compiled)
+    return compiled
+
+  def compile(self, query):
+    """
+      Parses the query into a template: the parameter agnostic tree
+      described in the module documentation.
+    """
+    template = parser(tokenize(query), self.django_operators).parse()
+    if self.model is not None and template is not None:
+      template = self.resolve(template)
+    return template
+
+  def resolve(self, node):
+    """
+      Resolves the fields in the tree against the model, converting literal
+      values right away. Unknown fields are rejected here, before any query
+      is built.
+    """
+    kind = node[0]
+    if kind=="cmp":
+      kind, path, operator, value = node
+      field = self.get_field(path)
+      value = self.resolve_value(value, field, operator.replace("~", ""))
+      return ("cmp", path, operator, value, field)
+    elif kind=="not":
+      return ("not", self.resolve(node[1]))
+    return (kind, [self.resolve(child) for child in node[1]])
+
+  def resolve_value(self, node, field, lookup):
+    kind, value = node
+    if kind=="literal":
+      return ("literal", self.coerce(field, lookup, value))
+    elif kind=="list":
+      if lookup=="in":
+        lookup = "exact"
+      return ("list", [self.resolve_value(v, field, lookup) for v in value])
+    return node
+
+  def get_field(self, path):
+    """
+      Returns the model field that values compared against the given field
+      path should be converted with. Relations are followed across "__",
+      and relations themselves compare against the related primary key.
+    """
+    return self.resolve_path(path)[0]
+
+  def resolve_path(self, path):
+    """
+      Returns a (field, joins, indexed) tuple for the given field path:
+      the field values are converted with, the number of joins the lookup
+      needs, and whether the compared column is indexed.
+    """
+    info = self.paths.get(path)
+    if info is not None:
+      return info
+
+    model = self.model
+    joins = 0
+    names = path.split("__")
+    for i, name in enumerate(names):
+      if model is None:
+        raise QueryFieldError("The field '%s' has no related fields" %
+          ".".join(names[:i]))
+      if i > 0:
+        #following a relationship to another model's fields means a join
+        joins += 1
+      opts = model._meta
+      if name=="pk":
+        field, model, indexed = opts.pk, None, True
+        continue
+      try:
+        f, m, direct, m2m = opts.get_field_by_name(name)
+      except FieldDoesNotExist:
+        raise QueryFieldError("Unknown field '%s'" % ".".join(names[:i + 1]))
+      if not direct or m2m:
+        #the reverse side of a relationship, or a many to many relationship,
+        #always needs a join to even compare against the related keys
+        model = direct and f.rel.to or f.model
+        field, indexed = model._meta.pk, True
+        joins += m2m and 2 or 1
+        if i + 1 < len(names):
+          #the join to the related model is already accounted for
+          joins -= 1
+      elif f.rel:
+        model = f.rel.to
+        field, indexed = f.rel.get_related_field(), f.db_index or f.unique
       else:
-        return value
-
-    def evaluate_not(n, obj):
-      """
-        return a django Q object, and invert it, based on the value of n
-      """
-      if n:
-        return ~obj
+        field, model = f, None
+        indexed = f.db_index or f.unique or f.primary_key
+
+    info = (field, joins, indexed)
+    self.paths[path] = info
+    return info
+
+  def unindexed_paths(self, node):
+    """
+      Returns the list of field paths in the compiled query that compare
+      against columns without an index.
+    """
+    if node is None or self.model is None:
+      return []
+    kind = node[0]
+    if kind=="cmp":
+      if not self.resolve_path(node[1])[2]:
+        return [node[1]]
+      return []
+    elif kind=="not":
+      return self.unindexed_paths(node[1])
+    paths = []
+    for child in node[1]:
+      paths.extend([p for p in self.unindexed_paths(child) if p not in paths])
+    return paths
+
+  def describe(self, node):
+    """
+      Renders the compiled query without its values, e.g. "(poll exact ? AND
+      answer exact ?)", so that queries which only differ in their literals or
+      parameters are described the same way.
+    """
+    if node is None:
+      return ""
+    kind = node[0]
+    if kind=="cmp":
+      return "%s %s ?" % (node[1], node[2])
+    elif kind=="not":
+      return "NOT %s" % self.describe(node[1])
+    return "(%s)" % (" %s " % kind.upper()).join(
+      [self.describe(child) for child in node[1]])
+
+  def cost(self, node):
+    """
+      Returns the cost of running the compiled query.
+    """
+    if node is None:
+      return 0
+    kind = node[0]
+    if kind=="not":
+      return self.cost(node[1])
+    elif kind!="cmp":
+      return sum([self.cost(child) for child in node[1]])
+
+    path, operator = node[1], node[2]
+    lookup = operator.replace("~", "")
+    if self.model is not None:
+      field, joins, indexed = self.resolve_path(path)
+    else:
+      joins, indexed = path.count("__"), False
+
+    cost = self.operator_costs.get(lookup, self.unknown_operator_cost) + \
+      joins * self.join_cost
+    if not indexed or lookup not in self.indexable_lookups:
+      cost *= self.unindexed_factor
+    return cost
+
+  def coerce(self, field, lookup, value):
+    """
+      Converts a value to the python type of the field it is compared with.
+    """
+    if isinstance(value, (list, tuple)):
+      return [self.coerce(field, lookup, v) for v in value]
+    if lookup=="in":
+      value = self.convert_value(value)
+      if not isinstance(value, list):
+        value = [value]
+      return [self.coerce(field, "exact", v) for v in value]
+    if value is None:
+      return None
+    if lookup in text_lookups:
+      return force_unicode(value)
+    try:
+      return field.to_python(value)
+    except ValidationError, err:
+      raise QueryFieldError("Invalid value %r for the field '%s': %s" %
+        (value, field.name, " ".join(err.messages)))
+
+  def convert_value(self, value):
+    """
+      Convert the value that comes in as string to
+      the right python datatype.
+      Currently supports conversion to
+      int, string, tuple
+    """
+    #when the model is known, coerce() uses the field types instead
+
+    #If we have a non-string alredy, return it
+    if not isinstance(value, basestring):return value
+
+    value = value.replace("'", "")
+
+    #this is a number value
+    if value.isdigit():
+      return int(value)
+    #this is a collection. we could also match against \(.*?\) but that takes longer and the solution below should suffice
+    elif value[:1]=="(":
+      return [self.convert_value(x.strip())
+            for x in tuple(value[1:-1].split(','))] #recursive list comprehension ftw.
+    #string
+    else:
+      return value
+
+  def bind_value(self, node, parameters, field=None, lookup=None):
+    kind, value = node
+    if kind=="literal":
+      return value
+    elif kind=="list":
+      #like resolve_value, each item of an IN list is a single value
+      if lookup=="in":
+        lookup = "exact"
+      return [self.bind_value(v, parameters, field, lookup) for v in value]
+
+    #try to find a replacement for the parameter, otherwise we keep the
+    #placeholder as a string
+    if parameters.get(value):
+      value = parameters.get(value)
+      if field is not None:
+        return self.coerce(field, lookup, value)
+      return self.convert_value(value)
+    return "{%s}" % value
+
+  def bind(self, template, parameters = {}):
+    """
+      Substitutes the parameters into a compiled template and builds the
+      django Q object from it.
+    """
+    if template is None:
+      return None
+
+    kind = template[0]
+    if kind=="cmp":
+      path, operator, value = template[1:4]
+      field = len(template) > 4 and template[4] or None
+      #we remove the ~ that was added to mark inverted values
+      #also, we need to covnert to ascii, as django does not support unicode key fields
+      lookup = operator.replace("~", "")
+      value = self.bind_value(value, parameters, field, lookup)
+      obj = Q(**{"%s__%s" % (path.encode('ascii'), lookup): value})
+      #django doesn't have an equivalent to != or not contains. instead, the
+      #opposite expresion has to be used.
+      if operator[0]=="~":
+        obj = ~obj
+      return obj
+    elif kind=="not":
+      return ~self.bind(template[1], parameters)
+
+    #collect the children directly, since chaining & or | would copy the
+    #growing Q object once for each child. like Q.add, children that use the
+    #same connector are flattened into this node.
+    connector = kind=="and" and Q.AND or Q.OR
+    children = []
+    for child in template[1]:
+      child = self.bind(child, parameters)
+      if not child.negated and (child.connector==connector or len(child)==1):
+        children.extend(child.children)
       else:
-        return obj
-
-    for entry in self.stack:
-      if type(entry)==type(()): #got a tuple
-
-        #this shouldn't happen, but nevertheless check for it to prevent accidental breaking here.
-        if len(entry)!=3:continue
-
-        lfield = entry[0]
-        operator = self.django_operators[entry[1]]
-        rfield = entry[2]
-
-        #if the lfield contains dots, these have to be converted to __ as that is the django field seperator
-        lfield = lfield.replace(".", "__")
-        
-        #try to find a replacement for the rfield in our parameters
-        if rfield.find("{")!=-1:
-          rfield_ = rfield.replace("{", "").replace("}", "")
-          if parameters.get(rfield_):
-            rfield = parameters.get(rfield_)
-
-        #we have to try to convert the object type to int
-        rfield = convert_value(rfield)
-
-        kwargs = {
-          #we remove the ~ that was added to mark inverted values
-	  #also, we need to covnert to ascii, as django does not support unicode key fields
-          "%s__%s" % (lfield.encode('ascii') , operator.replace("~", "")):
-          rfield
-        }
-        
-        #create a q object
-        if combinator:
-          
-          #if the obj operator contains a ~ we have to invert it. this is because django doesn't have a
-          #equivalent to != or not contains. instead, the opposite expresion has to be used.
-          if operator[0]=="~":
-            if combinator.has_not: combinator.has_not=False
-            else: combinator.has_not=True
-          
-          if combinator.has_and:
-            obj = obj & evaluate_not(combinator.has_not, Q(**kwargs))
-          elif combinator.has_or:
-            obj = obj | evaluate_not(combinator.has_not, Q(**kwargs))
-        else:
-          obj = evaluate_not(not operator.find("~"), Q(**kwargs))
-      
-      if obj and type(entry)==type([]):
-        combinator = logic_expression(entry)
-    
+        children.append(child)
+    obj = Q()
+    obj.connector = connector
+    obj.children = children
     return obj
 
 
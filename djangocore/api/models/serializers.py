@@ -0,0 +1,208 @@
+# Django dependencies.
+from django.utils.hashcompat import md5_constructor
+from django.utils.encoding import smart_unicode, is_protected_type
+
+# Intra-app dependencies.
+from djangocore.api.models.exposed import cached_method
+from djangocore.utils import deconstruct
+
+
+class Row(object):
+    """
+    Exposes the values of a plain database row as attributes, the way the
+    model's fields read them off of instances.
+
+    """
+    def __init__(self, values):
+        self.__dict__.update(values)
+
+
+class SerializationPlan(object):
+    """
+    A precompiled description of how to turn instances of a Django model
+    into the same python structures that Django's own `python` serializer
+    produces.
+
+    All of the introspection (walking `_meta`, applying the `fields`
+    whitelist, resolving foreign key attnames and looking up exposed
+    methods) happens once, when the plan is built. Serializing a row is
+    then just a loop over a list of precomputed accessors.
+
+    """
+    batch_size = 500 # The number of objects to compute batch methods for at
+                     # once, when serializing lazily.
+
+    def __init__(self, model, fields=()):
+        self.model = model
+        self.fields = tuple(fields or ())
+
+        opts = model._meta
+        self.label = smart_unicode(opts)
+
+        selected = self.fields or None
+
+        # Each accessor is a (name, field, kind) tuple.
+        self.accessors = []
+        self.fk_attnames = []
+        for field in opts.local_fields:
+            if not field.serialize:
+                continue
+            if field.rel is None:
+                if selected is None or field.attname in selected:
+                    self.accessors.append((field.name, field, 'field'))
+            else:
+                if selected is None or field.attname[:-3] in selected:
+                    # If the relationship points at the related model's
+                    # primary key, the value stored in the attname is
+                    # already what the serializer would emit.
+                    to_pk = field.rel.get_related_field().primary_key
+                    kind = to_pk and 'fk' or 'fk_value'
+                    self.accessors.append((field.name, field, kind))
+                    self.fk_attnames.append(field.attname)
+
+        self.m2m_names = []
+        for field in opts.many_to_many:
+            if not field.serialize or not field.rel.through._meta.auto_created:
+                continue
+            if selected is None or field.attname in selected:
+                self.m2m_names.append(field.name)
+
+        # Look up the exposed methods once, rather than once per row, and
+        # wrap the ones with a `cache` option. Batch methods are computed for
+        # many objects at once by their `batch_function` instead.
+        self.exposed = []
+        self.batched = []
+        for name in getattr(model, 'exposedMethods', ()):
+            method = getattr(model, name)
+            if getattr(method, 'cache', None):
+                method = cached_method(model, name, method)
+            self.exposed.append((name, method))
+            if getattr(method, 'batch', False):
+                self.batched.append((name, method.batch_function))
+
+        # Decimals are the only values we emit that still have to be
+        # deconstructed before they can be handed to an emitter.
+        self.clean = not [f for name, f, kind in self.accessors
+            if f.get_internal_type() == 'DecimalField']
+
+        # Without many to many fields and exposed methods, rows can be
+        # serialized from the plain values of these columns, the primary key
+        # first, rather than from model instances.
+        self.needs_instances = bool(self.m2m_names or self.exposed)
+        columns = [opts.pk] + [f for name, f, kind in self.accessors
+            if f is not opts.pk]
+        self.columns = [f.name for f in columns]
+        self.column_attnames = [f.attname for f in columns]
+
+        # Identifies the shape of the records this plan produces, e.g. for
+        # keying cached records.
+        names = [name for name, f, kind in self.accessors] + self.m2m_names + \
+            [name for name, method in self.exposed]
+        self.signature = md5_constructor(repr((self.label, names))).hexdigest()
+
+    def batch_values(self, objects):
+        """
+        Calls the batch functions of the plan's exposed methods for the given
+        list of objects. Returns a dictionary mapping the name of each batch
+        method to a dictionary of primary keys to values.
+
+        """
+        values = {}
+        if objects:
+            for name, function in self.batched:
+                values[name] = function(self.model, objects)
+        return values
+
+    def serialize_fields(self, obj, batched=None):
+        """
+        Returns a dictionary of the serialized fields for a single model
+        instance. Exposed methods whose values are in the given `batched`
+        dictionary (see `batch_values`) aren't called.
+
+        """
+        fields = {}
+        for name, field, kind in self.accessors:
+            value = getattr(obj, field.attname)
+            if kind == 'fk':
+                pass
+            elif kind == 'fk_value':
+                if value is not None:
+                    value = smart_unicode(value, strings_only=True)
+            elif not is_protected_type(value):
+                value = field.value_to_string(obj)
+            fields[name] = value
+
+        prefetched = getattr(obj, '_prefetched_objects_cache', {})
+        for name in self.m2m_names:
+            related = getattr(obj, name)
+            if name in prefetched:
+                related = related.all()
+            else:
+                related = related.iterator()
+            fields[name] = [smart_unicode(o._get_pk_val(), strings_only=True)
+                for o in related]
+
+        # Exposed methods can return anything, so we deconstruct their
+        # results right away to keep the output clean.
+        for name, method in self.exposed:
+            if batched and name in batched:
+                value = batched[name].get(obj._get_pk_val())
+            else:
+                value = method(obj)
+            fields[name] = deconstruct(value)
+
+        return fields
+
+    def serialize(self, obj, batched=None):
+        return {
+            'model': self.label,
+            'pk': smart_unicode(obj._get_pk_val(), strings_only=True),
+            'fields': self.serialize_fields(obj, batched),
+        }
+
+    def serialize_row(self, values):
+        """
+        Serializes a tuple of the values of the plan's `columns`, as
+        returned by `values_list`.
+
+        """
+        return {
+            'model': self.label,
+            'pk': smart_unicode(values[0], strings_only=True),
+            'fields': self.serialize_fields(Row(zip(self.column_attnames,
+                values))),
+        }
+
+    def iter_serialize_rows(self, rows):
+        """Lazily serializes each tuple of column values in the given rows."""
+        serialize_row = self.serialize_row
+        for values in rows:
+            yield serialize_row(values)
+
+    def iter_serialize(self, iterable):
+        """
+        Lazily serializes each model instance in the given iterable. If the
+        plan has batch methods, the instances are serialized `batch_size` at
+        a time, with one call of each batch function per chunk.
+
+        """
+        serialize = self.serialize
+        if not self.batched:
+            for obj in iterable:
+                yield serialize(obj)
+            return
+
+        chunk = []
+        for obj in iterable:
+            chunk.append(obj)
+            if len(chunk) == self.batch_size:
+                for record in self.serialize_many(chunk):
+                    yield record
+                chunk = []
+        for record in self.serialize_many(chunk):
+            yield record
+
+    def serialize_many(self, iterable):
+        objects = list(iterable)
+        batched = self.batch_values(objects)
+        return [self.serialize(obj, batched) for obj in objects]
@@ -0,0 +1,77 @@
+"""
+Per-model version counters, used to invalidate cached data.
+
+Every tracked model has a counter in Django's cache framework, which is
+bumped whenever an instance of the model is saved or deleted. Anything
+that is derived from a model's rows can then include the model's current
+version in its cache key, and is implicitly invalidated on the next
+write.
+
+"""
+import time
+
+# Django dependencies.
+from django.core.cache import cache
+from django.db.models import signals
+
+def version_key(model):
+    opts = model._meta
+    return 'djangocore:version:%s.%s' % (opts.app_label, opts.module_name)
+
+def get_model_version(model):
+    """
+    Returns the current version of the given model, or None if the cache
+    doesn't keep it (e.g. the dummy backend), in which case nothing should
+    be cached by version.
+    
+    """
+    key = version_key(model)
+    version = cache.get(key)
+    if version is None:
+        # Start from the current time rather than from 1, so that a counter
+        # which got evicted never reuses the version of an older entry.
+        cache.add(key, int(time.time() * 1000))
+        version = cache.get(key)
+    return version
+
+def bump_model_version(model):
+    """Invalidates everything that was cached for the given model."""
+    key = version_key(model)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # The counter doesn't exist (anymore); start a new one.
+        cache.add(key, int(time.time() * 1000))
+
+def _bump_sender_version(sender, **kwargs):
+    bump_model_version(sender)
+
+def _bump_relation_version(model):
+    """
+    Returns a m2m_changed handler which bumps the version of the given
+    model.
+
+    """
+    def bump(sender, action, **kwargs):
+        if action.startswith('post_'):
+            bump_model_version(model)
+    return bump
+
+def track_model(model):
+    """
+    Connects the signal handlers which bump the model's version whenever
+    an instance is saved or deleted, or one of its many to many relations
+    changes. Safe to call more than once.
+
+    """
+    uid = version_key(model)
+    signals.post_save.connect(_bump_sender_version, sender=model,
+        dispatch_uid=uid)
+    signals.post_delete.connect(_bump_sender_version, sender=model,
+        dispatch_uid=uid)
+    for field in model._meta.many_to_many:
+        through = field.rel.through
+        if through._meta.auto_created:
+            signals.m2m_changed.connect(_bump_relation_version(model),
+                sender=through, dispatch_uid='%s:%s' % (uid, field.name),
+                weak=False)
@@ -1,9 +1,15 @@
+import re
+
 # Django dependencies.
-from django.http import HttpResponseNotAllowed, Http404
+from django.conf import settings
+from django.http import HttpResponseNotAllowed, HttpResponseNotModified, \
+    Http404
+from django.utils.http import parse_etags, quote_etag
 from django.conf.urls.defaults import patterns, url, include
 
 # Intra-app dependencies.
 from djangocore.utils import underscore
+from djangocore.api.utils import Bubbler, reset_request_memo
 from djangocore.serialization import mimer, MalformedData, EmittableResponse
 
 
@@ -15,6 +21,9 @@ class BaseResource(object):
     """
     anonymous = False # When set to True, skips authenticating requests entirely.
     allowed_operations = () # Filters handler functions if given. See `ops` below.
+    max_body_size = getattr(settings, 'SPROUTCORE_MAX_BODY_SIZE',
+        10 * 1024 * 1024) # The largest request body (in bytes) to accept,
+                          # or None for no limit.
     
     class Auth:
         pass
@@ -53,13 +62,31 @@ class BaseResource(object):
         return dict([(m.upper(), getattr(self, op)) for m, op in ops.items()
           if op in self.allowed_operations or not self.allowed_operations])
 
+    def get_routes(self):
+        """
+        Returns a list of (path, ops) tuples, mapping the paths below this
+        resource's url prefix to dictionaries of allowed methods and handler
+        functions, as returned by `ops`.
+        
+        """
+        raise NotImplementedError
+
     def get_urls(self):
         """
         Returns a urlpatterns object mapping urls and request methods
         for this resource to the appropriate data handler functions.
         
         """
-        raise NotImplementedError
+        return patterns('', *[url('^%s$' % re.escape(path), self.mapper, ops)
+            for path, ops in self.get_routes()])
+
+    def get_dispatch_table(self):
+        """
+        Returns a dictionary mapping the paths below this resource's url
+        prefix to their ops, for use by `ResourceSite.dispatch`.
+        
+        """
+        return dict(self.get_routes())
 
     def urls(self):
         return self.get_urls()
@@ -95,12 +122,25 @@ class BaseResource(object):
         # Deserialize the data we recieved, if any.
         if request.method in ('PUT', 'POST'):
             mimer.translate(request)
+
+    def get_etag(self, request, handler):
+        """
+        Returns an ETag for the response the given handler would return, or
+        None if the response can't be validated without computing it. The
+        ETag must change whenever the response's content would.
+        
+        """
+        return None
     
     def mapper(self, request, **ops):
         """
         Maps a given url and request method to a given handler function.
         
         """
+        # Values memoized for the previous request must not leak into this
+        # one.
+        reset_request_memo()
+
         if not ops:
             # There are no allowed operations for the given URL.
             raise Http404
@@ -112,24 +152,48 @@ class BaseResource(object):
             return HttpResponseNotAllowed(ops.keys())
         
         if not self.is_authenticated(request, handler):
-            return EmittableResponse("", status=403)
+            return self.process_response(EmittableResponse("", status=403),
+                request)
                 
+        if self.max_body_size is not None and \
+          mimer.content_length(request) > self.max_body_size:
+            # Refuse the request before any of its body is read.
+            return self.process_response(EmittableResponse("The request body "
+                "cannot be larger than %d bytes" % self.max_body_size,
+                status=413), request)
+
         try:
             self.process_request(request)
         except MalformedData, err:
             # The data sent in the request was malformed.
-            return EmittableResponse(str(err), status=400)
+            return self.process_response(EmittableResponse(str(err),
+                status=400), request)
         
-        response = handler(request)
+        etag = None
+        if request.method == 'GET':
+            etag = self.get_etag(request, handler)
+            if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+            if etag and if_none_match:
+                # Answer conditional requests before doing any real work.
+                etags = parse_etags(if_none_match)
+                if etag in etags or '*' in etags:
+                    response = HttpResponseNotModified()
+                    response['ETag'] = quote_etag(etag)
+                    return response
+
+        try:
+            response = handler(request)
+        except Bubbler, bubbler:
+            # Handlers (and their helpers) can bail out early by raising a
+            # Bubbler with the response to return.
+            response = bubbler.contents
+        except MalformedData, err:
+            # The data sent in the request, which is only deserialized when
+            # the handler first accesses it, was malformed.
+            response = EmittableResponse(str(err), status=400)
 
         response = self.process_response(response, request)
 
+        if etag and response.status_code == 200:
+            response['ETag'] = quote_etag(etag)
         return response
-
-# TODO: Add in some way to catch errors...        
-#
-#        from djangocore.api.utils import Bubbler
-#        try:
-#           ...
-#        except Bubbler:
-#            return Bubbler.contents
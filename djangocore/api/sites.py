@@ -1,5 +1,6 @@
 # Django dependencies.
 from django.conf.urls.defaults import patterns, url, include
+from django.http import Http404
 
 # Intra-app dependencies.
 from djangocore.api.auth.authenticators import AnonymousAuthenticator
@@ -13,6 +14,7 @@ class NotRegistered(Exception):
 class ResourceSite(object):
     def __init__(self, name=None, app_name='api'):
         self._registry = {}
+        self._routes = {} # Maps full paths to (resource, ops) tuples.
         self._authenticator = AnonymousAuthenticator
 
         if name is None:
@@ -51,6 +53,8 @@ class ResourceSite(object):
             raise AlreadyRegistered("The resource %s is already registered at "
                 "'%s'" % (Resource.__name__, key))
         self._registry[key] = resource
+        for path, ops in resource.get_dispatch_table().items():
+            self._routes[key + path] = (resource, ops)
     
     def unregister(self, key, **options):
         if not isinstance(key, basestring):
@@ -64,7 +68,9 @@ class ResourceSite(object):
         if not key in self._registry:
             raise NotRegistered('The resource %s is not registered' %
                 Resource.__name__)
-        del self._registry[key]
+        resource = self._registry.pop(key)
+        for path in resource.get_dispatch_table():
+            del self._routes[key + path]
 
     def get_urls(self, prefix=None):
         urlpatterns = patterns('')
@@ -86,5 +92,40 @@ class ResourceSite(object):
         return self.get_urls(), self.app_name, self.name
     urls = property(urls)
 
+    def resolve(self, path):
+        """
+        Returns the (resource, ops) tuple for the given path below the
+        site's root, e.g. 'models/polls/poll/list/', or raises Http404.
+        
+        """
+        try:
+            return self._routes[path]
+        except KeyError:
+            raise Http404
+
+    def dispatch(self, request, path):
+        """
+        A view which dispatches requests to the site's resources with a
+        single dictionary lookup, instead of having Django's resolver try
+        the url patterns of every resource in turn.
+        
+        """
+        resource, ops = self.resolve(path)
+        return resource.mapper(request, **ops)
+
+    def dispatch_urls(self):
+        """
+        An alternative to `urls`, which mounts the whole site as a single
+        url pattern handled by `dispatch`:
+        
+            (r'^api/', include(site.dispatch_urls)),
+        
+        """
+        urlpatterns = patterns('',
+            url(r'^(?P<path>.*)$', self.dispatch),
+        )
+        return urlpatterns, self.app_name, self.name
+    dispatch_urls = property(dispatch_urls)
+
 site = ResourceSite()
 
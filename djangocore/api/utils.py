@@ -1,3 +1,21 @@
+import threading
+
 class Bubbler(Exception):
     def __init__(self, contents):
         self.contents = contents
+
+_request_local = threading.local()
+
+def request_memo():
+    """
+    Returns a dictionary for memoizing values during the current request.
+    The mapper empties it whenever a request starts.
+    
+    """
+    memo = getattr(_request_local, 'memo', None)
+    if memo is None:
+        memo = _request_local.memo = {}
+    return memo
+
+def reset_request_memo():
+    _request_local.memo = {}
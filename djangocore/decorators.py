@@ -18,11 +18,37 @@ def expose(**kwargs):
         Instance Method Decorator. Rread-Only.
         Example:
         @expose(sd_type="Django.CharField", sd_default="", sd_verbose_name="UpperCaseName", sd_comment="Returns the name in uppercase")
+
+        Methods that follow relations can list them in `sd_depends`, e.g.
+        sd_depends=('poll',), so that model resources load them along with
+        each page of objects (with select_related or prefetch_related).
+
+        Results can be cached with cache='request' (once per object and
+        request), cache='ttl:<seconds>' or cache='version' (until an
+        instance of the model is saved or deleted). See
+        `djangocore.api.models.exposed`.
+
+        With batch=True, the method computes the values of many objects at
+        once, e.g. for a whole page of objects with one aggregate query:
+
+        @expose(batch=True, ...)
+        def total_votes(cls, polls):
+            return dict([(p.pk, ...) for p in polls])
+
+        Calling it on a single instance still returns that instance's value.
     """
     def wrap(f):
-        def wrapped_f(*args):
-            f.attr = 'expose'
-            return f(*args)
+        if kwargs.get('batch'):
+            # Batch methods take the model class and a list of instances, and
+            # return a dictionary mapping their primary keys to the values.
+            def wrapped_f(self):
+                f.attr = 'expose'
+                return f(self.__class__, [self]).get(self._get_pk_val())
+            wrapped_f.batch_function = f
+        else:
+            def wrapped_f(*args):
+                f.attr = 'expose'
+                return f(*args)
         for key in kwargs:
             wrapped_f.__setattr__(key, kwargs.get(key))
         wrapped_f.sd_name = f.func_name
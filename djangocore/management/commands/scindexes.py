@@ -0,0 +1,33 @@
+# Django dependencies.
+from django.core.management.base import BaseCommand
+
+# Intra-app dependencies.
+from djangocore.api import autodiscover, site
+from djangocore.api.models.indexes import get_unindexed_queries
+
+class Command(BaseCommand):
+    help = 'Lists the unindexed fields of every registered model resource, \
+            along with the observed queries that ordered or filtered on them.'
+
+    def handle(self, *args, **options):
+        autodiscover()
+
+        for url_prefix in sorted(site._registry):
+            resource = site._registry[url_prefix]
+            indexed = getattr(resource, 'indexed_fields', None)
+            if indexed is None:
+                # Not a Django model resource.
+                continue
+
+            unindexed = [f.name for f in resource.model._meta.fields
+                if f.name not in indexed]
+            self.stdout.write('%s (%s)\n' % (url_prefix,
+                resource.unindexed_query_policy))
+            self.stdout.write('  indexed: %s\n' % ', '.join(indexed))
+            self.stdout.write('  unindexed: %s\n' % ', '.join(unindexed))
+
+            for (ordering, conditions, paths), count in \
+              get_unindexed_queries(resource):
+                self.stdout.write('  %6d x %s -- ordering: %s, conditions: '
+                    '%s\n' % (count, ', '.join(paths), ', '.join(ordering),
+                    conditions))
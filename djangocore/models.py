@@ -0,0 +1,95 @@
+import os
+
+# Django dependencies.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import models
+from django.db.models import signals
+from django.utils.hashcompat import sha_constructor
+
+# Intra-app dependencies.
+from djangocore.utils import LRUCache
+
+# Maps token digests to (user, expires) tuples, so that repeat requests with
+# the same token don't have to hit the database. Entries are dropped when
+# their token or user changes, but other processes only notice that once the
+# entry expires.
+token_cache = LRUCache(
+    size=getattr(settings, 'SPROUTCORE_TOKEN_CACHE_SIZE', 1024),
+    ttl=getattr(settings, 'SPROUTCORE_TOKEN_CACHE_TTL', 300))
+
+def hash_token(token):
+    """Returns the digest under which the given token is stored."""
+    return sha_constructor(token).hexdigest()
+
+class APITokenManager(models.Manager):
+    def create_token(self, user, expires=None):
+        """
+        Creates a new token for the given user, and returns it along with
+        the token string itself, which isn't stored anywhere.
+
+        """
+        token = os.urandom(20).encode('hex')
+        obj = self.create(user=user, digest=hash_token(token), expires=expires)
+        return obj, token
+
+class APIToken(models.Model):
+    """
+    A token which authenticates API clients as its user. Only the digest
+    of the token is stored.
+
+    """
+    user = models.ForeignKey(User, related_name='api_tokens')
+    digest = models.CharField(max_length=64, unique=True)
+    created = models.DateTimeField(auto_now_add=True)
+    expires = models.DateTimeField(null=True, blank=True)
+
+    objects = APITokenManager()
+
+    def __unicode__(self):
+        return u'API token for %s' % self.user
+
+def _revoke_token(sender, instance, **kwargs):
+    token_cache.delete(instance.digest)
+
+# The fields whose changes revoke the cached tokens of a user. Other saves
+# (e.g. of `last_login` on every login) leave the cache alone.
+revoking_fields = ('is_active', 'is_staff', 'is_superuser', 'password')
+
+def _auth_state(user):
+    return tuple([getattr(user, name) for name in revoking_fields])
+
+def _remember_auth_state(sender, instance, **kwargs):
+    instance._djangocore_auth_state = _auth_state(instance)
+
+def _revoke_user_tokens(sender, instance, **kwargs):
+    for digest in APIToken.objects.filter(user=instance) \
+      .values_list('digest', flat=True):
+        token_cache.delete(digest)
+
+def _revoke_changed_user_tokens(sender, instance, created, **kwargs):
+    # The user may have been deactivated, or lost their permissions.
+    state = _auth_state(instance)
+    if not created and state != getattr(instance, '_djangocore_auth_state',
+      None):
+        _revoke_user_tokens(sender, instance)
+    instance._djangocore_auth_state = state
+
+def track_token_users():
+    """
+    Connects the signal handlers which revoke the cached tokens of users
+    whose authentication changes. They run for every user that is loaded or
+    saved, so they are only connected once tokens are in use. Safe to call
+    more than once.
+
+    """
+    uid = 'djangocore:tokens'
+    signals.post_init.connect(_remember_auth_state, sender=User,
+        dispatch_uid=uid)
+    signals.post_save.connect(_revoke_changed_user_tokens, sender=User,
+        dispatch_uid=uid)
+    signals.pre_delete.connect(_revoke_user_tokens, sender=User,
+        dispatch_uid=uid)
+
+signals.post_save.connect(_revoke_token, sender=APIToken)
+signals.post_delete.connect(_revoke_token, sender=APIToken)
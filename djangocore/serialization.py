@@ -1,3 +1,6 @@
+import itertools
+import re
+
 try:
     import cStringIO as StringIO
 except ImportError:
@@ -13,18 +16,29 @@ from django.conf import settings
 from django.utils import simplejson
 from django.utils.encoding import force_unicode
 from django.utils.xmlutils import SimplerXMLGenerator
-from django.http import HttpResponse, HttpResponseBadRequest
+from django.http import HttpResponse, HttpResponseBadRequest, QueryDict
+from django.http.multipartparser import MultiPartParserError
+from django.core.handlers.wsgi import LimitedStream
 from django.core.serializers.json import DjangoJSONEncoder 
 
 from djangocore.utils import deconstruct
 
 class EmittableResponse(object):
     """A thin wrapper for returning an HttpResponse whose contents can be 
-    serialized."""
-    def __init__(self, content, **ops):
+    serialized. Set `clean` if the content is already made up of plain
+    python types, so that it doesn't need to be deconstructed."""
+    def __init__(self, content, clean=False, **ops):
         self.content = content
+        self.clean = clean
         self.ops = ops
 
+class StreamingResponse(EmittableResponse):
+    """Wraps an iterable of items that should be emitted incrementally,
+    `chunk_size` items at a time, instead of being serialized in one go."""
+    def __init__(self, content, chunk_size=100, clean=False, **ops):
+        super(StreamingResponse, self).__init__(content, clean, **ops)
+        self.chunk_size = chunk_size
+
 class AlreadyRegistered(Exception):
     """Raised when trying to register a content type that has already
     been registered."""
@@ -39,30 +53,68 @@ class MalformedData(Exception):
     """Raised when loading the data in the request body fails."""
     pass
     
+class LazyDataRequest(object):
+    """Mixed into the class of requests passed to `Mimer.translate`, so
+    that the request body is only deserialized once `request.data` is
+    first accessed."""
+    def _get_data(self):
+        if not hasattr(self, '_data'):
+            self._data = self._mimer.load(self)
+        return self._data
+
+    def _set_data(self, data):
+        self._data = data
+
+    data = property(_get_data, _set_data)
+
 class Mimer(object):
     def __init__(self):
         self._registry = {}
+        self._streamers = {}
+        self._request_classes = {}
+
+    def media_type(self, ctype):
+        """Strips any parameters (e.g. the charset) from a content type."""
+        return ctype.split(';', 1)[0].strip().lower()
+        
+    def register(self, ctype_or_iterable, mimer, streamer=None):
+        """
+        Registers a function which deserializes request bodies of the given
+        content type(s). The optional `streamer` takes a file-like object
+        holding a list of records, and yields the records one at a time.
         
-    def register(self, ctype_or_iterable, mimer):
+        """
         if isinstance(ctype_or_iterable, basestring):
             ctype_or_iterable = [ctype_or_iterable]
         for ctype in ctype_or_iterable:
+            ctype = self.media_type(ctype)
             if ctype in self._registry:
                 raise AlreadyRegistered("The content type %s is already "
                   "registered" % ctype)
             self._registry[ctype] = mimer
+            if streamer:
+                self._streamers[ctype] = streamer
         
     def unregister(self, ctype_or_iterable):
         if isinstance(ctype_or_iterable, basestring):
             ctype_or_iterable = [ctype_or_iterable]
         for ctype in ctype_or_iterable:
+            ctype = self.media_type(ctype)
             if ctype not in self._registry:
                 raise NotRegistered("The content type %s is not registered"
                   % ctype)
             del self._registry[ctype]
+            self._streamers.pop(ctype, None)
     
     def mimer_for_ctype(self, ctype):
-        return self._registry.get(ctype, None)
+        return self._registry.get(self.media_type(ctype), None)
+
+    def content_length(self, request):
+        """Returns the length of the request body the client announced."""
+        try:
+            return int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            return 0
 
     def content_type(self, request):
         """
@@ -73,78 +125,170 @@ class Mimer(object):
         formencoded_ctype = "application/x-www-form-urlencoded"
 
         ctype = request.META.get('CONTENT_TYPE', formencoded_ctype).strip()
-        if ctype.startswith(formencoded_ctype) or ctype.startswith('multipart'):
+        media_type = self.media_type(ctype)
+        if media_type == formencoded_ctype or media_type.startswith('multipart'):
             return None
         
         return ctype
 
     def translate(self, request):
         """
-        Looks at the ``Content-type`` header sent by the client, and
-        attempts to deserialize the contents into the specified format.
+        Sets up ``request.data`` to hold the contents of the request,
+        deserialized according to the ``Content-type`` header sent by
+        the client. This works for JSON and YAML, as well as form data.
+        The data is placed in ``request.data`` since it is not
+        necessarily a simple list of key-value pairs.
         
-        This works for JSON and YAML. The deserialized data is placed in
-        ``request.data`` since it is not necessarily a simple list of
-        key-value pairs.
+        The body is only read and deserialized when ``request.data`` is
+        first accessed, which raises MalformedData if that fails.
         
         Also sets ``request.content_type``. ``request.content_type``
         will be set to None for form-encoded or multipart form data.
         
         """    
-        ctype = self.content_type(request)
-        request.content_type = ctype
-        request.data = None
+        request.content_type = self.content_type(request)
 
-        # For PUT requests we have to force django to load the request data.
-        if request.method == "PUT":
-            try:
-                request.method = "POST"
-                request._load_post_and_files()
-                request.method = "PUT"
-            except AttributeError:
-                request.META['REQUEST_METHOD'] = "POST"
-                request._load_post_and_files()
-                request.META['REQUEST_METHOD'] = "PUT"
-                
+        # Swap in a subclass of the request's class with a lazy `data`
+        # property, since properties can't be set on instances.
+        if not isinstance(request, LazyDataRequest):
+            cls = request.__class__
+            lazy_class = self._request_classes.get(cls)
+            if lazy_class is None:
+                lazy_class = type(cls.__name__, (LazyDataRequest, cls), {})
+                self._request_classes[cls] = lazy_class
+            request.__class__ = lazy_class
+        request._mimer = self
+        
+        return request
+
+    def load(self, request):
+        """
+        Deserializes the body of the given request. Returns None for
+        content types that no mimer is registered for.
+        
+        """
+        ctype = request.content_type
         if ctype:
             mimer = self.mimer_for_ctype(ctype)
-            if mimer:
-                try:
-                    request.data = mimer(request.raw_post_data)
-                        
-                except (TypeError, ValueError):
-                    raise MalformedData("The '%s' data sent in the request was "
-                      "malformed" % ctype)
-        
-        elif request.method in ("PUT", "POST"):
-            # The data for PUT requests still resides in the POST variable,
-            # since we tricked django into loading it as POST data.
-            request.data = request.POST
-        # To reduce confusion, reset POST and PUT, since the data now resides
-        # in the request.data variable.
-        request.POST = {}
+            if not mimer:
+                return None
+            try:
+                return mimer(request.raw_post_data)
+            except (TypeError, ValueError):
+                raise MalformedData("The '%s' data sent in the request was "
+                  "malformed" % ctype)
+
+        if request.method == "POST":
+            return request.POST
+        if request.method == "PUT":
+            return self.load_form_data(request)
+        return None
+
+    def iter_records(self, request):
+        """
+        Returns an iterator over the list of records in the body of the
+        given request. When the content type has a streamer, the body is
+        decoded incrementally as the iterator is consumed, so neither the
+        whole body nor the whole list has to be held in memory; the
+        request's data can't be accessed afterwards.
         
-        return request
+        Raises MalformedData (possibly while iterating) if the body isn't
+        a list.
+        
+        """
+        ctype = request.content_type
+        streamer = ctype and self._streamers.get(self.media_type(ctype))
+        if not streamer or hasattr(request, '_data'):
+            data = request.data
+            if not isinstance(data, (list, tuple)):
+                raise MalformedData("The data sent in the request must be "
+                  "a list")
+            return iter(data)
+        return self._stream_records(request, streamer, ctype)
+
+    def _stream_records(self, request, streamer, ctype):
+        # Not every server's input stream stops at the end of the body.
+        stream = LimitedStream(request, self.content_length(request))
+        try:
+            for record in streamer(stream):
+                yield record
+        except ValueError:
+            raise MalformedData("The '%s' data sent in the request was "
+              "malformed" % ctype)
+
+    def load_form_data(self, request):
+        """
+        Parses the form data of a PUT request, which Django only does for
+        POST requests. Uploaded files end up in ``request.FILES``.
+        
+        """
+        ctype = self.media_type(request.META.get('CONTENT_TYPE', ''))
+        if ctype.startswith('multipart'):
+            try:
+                data, request._files = request.parse_file_upload(request.META,
+                    request)
+            except MultiPartParserError:
+                raise MalformedData("The multipart data sent in the request "
+                  "was malformed")
+            return data
+        return QueryDict(request.raw_post_data, encoding=request.encoding)
 
 class Emitter(object):
     def __init__(self):
         self._registry = {}
+        self._streamers = {}
+        self._encoders = {}
 
-    def register(self, format, emitter, ctype):
+    def register(self, format, emitter, ctype, streamer=None, encoder=None):
+        """
+        Registers an emitter function for the given format. Emitter
+        functions take the data to serialize and a `pretty` keyword
+        argument, which asks for human readable output.
+        
+        If given, the `streamer` function takes an iterable of items, a
+        chunk size and the `encoder` (or None), and yields the serialized
+        output piece by piece. Pretty output is never streamed.
+        
+        If given, the `encoder` function is used in place of the emitter
+        whenever pretty output isn't required. This is the hook for
+        plugging in faster (e.g. C-accelerated) serializers.
+        
+        """
         if format in self._registry:
             raise AlreadyRegistered("The emitter for %s is already registered"
               % format)
         self._registry[format] = (emitter, ctype)
+        if streamer:
+            self._streamers[format] = streamer
+        if encoder:
+            self._encoders[format] = encoder
         
     def unregister(self, format):
         if format not in self._registry:
             raise NotRegistered("The emitter for %s is not registered" % format)
         del self._registry[format]
+        self._streamers.pop(format, None)
+        self._encoders.pop(format, None)
+
+    def set_encoder(self, format, encoder):
+        """Swaps in a (faster) encoder for an already registered format."""
+        if format not in self._registry:
+            raise NotRegistered("The emitter for %s is not registered" % format)
+        if encoder:
+            self._encoders[format] = encoder
+        else:
+            self._encoders.pop(format, None)
     
     def emitter_for_format(self, format):
         return self._registry.get(format, (None, None))
+
+    def streamer_for_format(self, format):
+        return self._streamers.get(format, None)
+
+    def encoder_for_format(self, format):
+        return self._encoders.get(format, None)
                     
-    def translate(self, format, response):
+    def translate(self, format, response, pretty=False):
         # We catch and return any HttpResponses here for convenience's sake.
         # This really should be the developers responsibility
         if isinstance(response, HttpResponse):
@@ -158,35 +302,154 @@ class Emitter(object):
             if settings.DEBUG:
                 ctype = 'text/plain; charset=utf-8'
 
+            # Compact output is the default; humans get indented output.
+            pretty = pretty or settings.DEBUG
+            encoder = self.encoder_for_format(format)
+            if encoder and not pretty:
+                emit = encoder
+            else:
+                emit = lambda data: emitter(data, pretty=pretty)
+
             ops = {'content_type': ctype}            
+            if isinstance(response, StreamingResponse):
+                ops.update(response.ops)
+                streamer = self.streamer_for_format(format)
+                items = response.content
+                if not response.clean:
+                    items = (deconstruct(item) for item in items)
+                if streamer and not pretty:
+                    # Hand Django an iterator, so that the response is
+                    # sent to the client as it is being serialized. The
+                    # first chunk is serialized right away, so that errors
+                    # still surface inside the view.
+                    chunks = streamer(items, response.chunk_size, encoder)
+                    first = list(itertools.islice(chunks, 1))
+                    return HttpResponse(itertools.chain(first, chunks), **ops)
+                return HttpResponse(emit(list(items)), **ops)
+
+            clean = False
             if isinstance(response, EmittableResponse):
                 ops.update(response.ops)
+                clean = response.clean
                 response = response.content
             
-            # Deconstruct the response, serializer it, and then create a new
-            # HttpResponse with the given options specified.
-            response = deconstruct(response)
-            return HttpResponse(emitter(response), **ops)
+            # Deconstruct the response (unless it is known to be clean),
+            # serialize it, and then create a new HttpResponse with the given
+            # options specified.
+            if not clean:
+                response = deconstruct(response)
+            return HttpResponse(emit(response), **ops)
         return HttpResponseBadRequest("Cannot to serialize response to '%s' "
             "format specified in request" % format)        
     
 mimer = Mimer()
 emitter = Emitter()
 
-#add different json types as returned by browser-tests. mabye splitting at ';'
-#could make more sense
-#TODO: split the ctype, set to lowercase
-mimer.register(('application/json', 'application/json; charset=UTF-8',
-    'application/json; charset=utf-8'), lambda s: simplejson.loads(s))
-emitter.register('json', lambda s: simplejson.dumps(s,
-    cls=DjangoJSONEncoder, ensure_ascii=False, indent=4),
-    'application/json; charset=utf-8')
+_whitespace = re.compile(r'[ \t\n\r]*')
+
+def iter_json_array(stream, chunk_size=8192):
+    """
+    Decodes a JSON array from the given file-like object, yielding its
+    items one at a time. The stream is read `chunk_size` bytes at a time,
+    and only the part of it holding the current item is kept in memory.
+    Raises ValueError if the stream doesn't hold a JSON array.
+    
+    Items that don't fit in the buffer are decoded again once more of the
+    stream has been read. Each read doubles the buffer, so that large
+    items are decoded a logarithmic number of times rather than once per
+    chunk.
+    
+    """
+    decoder = simplejson.JSONDecoder()
+    buf, pos, eof = '', 0, False
+    expecting = '[' # '[', 'first' (an item or ']'), 'item' or ', or ]'.
+    while True:
+        pos = _whitespace.match(buf, pos).end()
+        if pos == len(buf):
+            if eof:
+                if expecting is None:
+                    return
+                raise ValueError("Unexpected end of JSON array")
+            chunk = stream.read(chunk_size)
+            eof = not chunk
+            buf, pos = buf[pos:] + chunk, 0
+            continue
+
+        if expecting is None:
+            raise ValueError("Extra data after JSON array")
+        char = buf[pos]
+        if expecting == '[':
+            if char != '[':
+                raise ValueError("Expected a JSON array")
+            pos, expecting = pos + 1, 'first'
+        elif expecting == ', or ]' or (expecting == 'first' and char == ']'):
+            if char not in ',]':
+                raise ValueError("Expected ',' or ']' between items")
+            pos, expecting = pos + 1, char == ',' and 'item' or None
+        else:
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                # The item may continue in the next chunk.
+                end = None
+                if eof:
+                    raise
+            # Numbers that end with the buffer may continue as well.
+            if end is None or (end == len(buf) and not eof):
+                chunk = stream.read(max(chunk_size, len(buf) - pos))
+                eof = not chunk
+                buf, pos = buf[pos:] + chunk, 0
+                continue
+            yield item
+            pos, expecting = end, ', or ]'
+
+# Content types are matched without their parameters, so this also covers
+# e.g. 'application/json; charset=UTF-8'.
+mimer.register('application/json', lambda s: simplejson.loads(s),
+    iter_json_array)
+
+def stream_json(items, chunk_size, encode=None):
+    """
+    Serializes an iterable of items as a compact JSON array, yielding the
+    output in chunks of `chunk_size` items, so that only one chunk has to
+    be held in memory at any time. Items are serialized with the given
+    `encode` function, if any.
+    
+    """
+    if encode is None:
+        encode = DjangoJSONEncoder(ensure_ascii=False,
+            separators=(',', ':')).encode
+    chunk = []
+    separator = '['
+    for item in items:
+        chunk.append(separator)
+        chunk.append(encode(item))
+        separator = ','
+        if len(chunk) >= chunk_size * 2:
+            yield ''.join(chunk)
+            chunk = []
+    if separator == '[':
+        # We never saw an item, so we still have to open the array.
+        chunk.append(separator)
+    chunk.append(']')
+    yield ''.join(chunk)
+
+def dump_json(data, pretty=False):
+    """Serializes data as compact JSON, or indented JSON if pretty."""
+    if pretty:
+        return simplejson.dumps(data, cls=DjangoJSONEncoder,
+            ensure_ascii=False, indent=4)
+    return simplejson.dumps(data, cls=DjangoJSONEncoder, ensure_ascii=False,
+        separators=(',', ':'))
+
+emitter.register('json', dump_json, 'application/json; charset=utf-8',
+    stream_json)
 
 if yaml:
     # YAML doesn't have an official mimetype, so we go with the common ones.
     mimer.register(('text/yaml', 'text/x-yaml', 'application/yaml', 
         'application/x-yaml'), lambda s: dict(yaml.load(s)))
-    emitter.register('yaml', lambda s: yaml.safe_dump(s),
+    emitter.register('yaml', lambda s, pretty=False: yaml.safe_dump(s),
         'text/x-yaml; charset=utf-8')
 
 def dump_xml(data):
@@ -219,4 +482,5 @@ def dump_xml(data):
     
     return stream.getvalue()
 
-emitter.register('xml', lambda s: dump_xml(s), 'text/xml; charset=utf-8')
\ No newline at end of file
+emitter.register('xml', lambda s, pretty=False: dump_xml(s),
+    'text/xml; charset=utf-8')
\ No newline at end of file
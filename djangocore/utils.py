@@ -1,14 +1,13 @@
 import re
+import time
 import decimal
+import datetime
+import threading
 
 from django.utils.encoding import force_unicode
+from django.utils.datastructures import SortedDict
 
-def deconstruct(item):
-    """
-    Recursively loops through the item's children, converting them all
-    to python types, falling back to calling Django's `force_unicode`.
-
-    """
+def _deconstruct_fallback(item):
     if isinstance(item, dict):
         return dict([(k, deconstruct(v)) for k, v in item.iteritems()])
     elif isinstance(item, decimal.Decimal):
@@ -19,7 +18,101 @@ def deconstruct(item):
         return None
     else:
         return force_unicode(item, strings_only=True)
- 
+
+def _identity(item):
+    return item
+
+def _deconstruct_dict(item):
+    return dict([(k, deconstruct(v)) for k, v in item.iteritems()])
+
+def _deconstruct_list(item):
+    return [deconstruct(v) for v in item]
+
+# Maps exact types to the function that deconstructs them. Types that are
+# already safe to serialize are passed through untouched. Anything else
+# (including subclasses of these types) goes through the fallback.
+_deconstructors = {
+    type(None): _identity,
+    bool: _identity,
+    int: _identity,
+    long: _identity,
+    float: _identity,
+    unicode: _identity,
+    datetime.datetime: _identity,
+    datetime.date: _identity,
+    datetime.time: _identity,
+    str: lambda item: force_unicode(item, strings_only=True),
+    decimal.Decimal: str,
+    dict: _deconstruct_dict,
+    list: _deconstruct_list,
+    tuple: _deconstruct_list,
+}
+
+def deconstruct(item):
+    """
+    Recursively loops through the item's children, converting them all
+    to python types, falling back to calling Django's `force_unicode`.
+
+    """
+    handler = _deconstructors.get(type(item))
+    if handler is None:
+        return _deconstruct_fallback(item)
+    return handler(item)
+
+class LRUCache(object):
+    """
+    A small, thread safe, in-process least-recently-used cache. If `ttl`
+    is given, entries also expire that many seconds after being set.
+    
+    """
+    def __init__(self, size=128, ttl=None):
+        self.size = size
+        self.ttl = ttl
+        self._data = SortedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        self._lock.acquire()
+        try:
+            try:
+                value, expires = self._data.pop(key)
+            except KeyError:
+                return default
+            if expires is not None and expires < time.time():
+                return default
+            # Re-insert the entry, to mark it as the most recently used one.
+            self._data[key] = (value, expires)
+            return value
+        finally:
+            self._lock.release()
+
+    def set(self, key, value):
+        expires = None
+        if self.ttl is not None:
+            expires = time.time() + self.ttl
+        self._lock.acquire()
+        try:
+            self._data.pop(key, None)
+            self._data[key] = (value, expires)
+            while len(self._data) > self.size:
+                del self._data[self._data.keyOrder[0]]
+        finally:
+            self._lock.release()
+
+    def delete(self, key):
+        self._lock.acquire()
+        try:
+            self._data.pop(key, None)
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._data.clear()
+        finally:
+            self._lock.release()
+
 def camelize(string):
     """
     Returns given string as CamelCased.
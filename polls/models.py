@@ -1,4 +1,7 @@
 from django.db import models
+from django.db.models import Sum
+
+from djangocore.decorators import expose
 
 class Poll(models.Model):
     """A poll."""
@@ -12,7 +15,22 @@ class Choice(models.Model):
     poll = models.ForeignKey(Poll)
     answer = models.CharField(max_length=255)
     votes = models.IntegerField(default=0)
+
+    exposedMethods = ['question', 'poll_votes']
     
     def __unicode__(self):
         return self.answer
 
+    @expose(sd_type="Django.CharField", sd_default="", sd_verbose_name="Question",
+        sd_comment="The question of the choice's poll", sd_depends=('poll',))
+    def question(self):
+        return self.poll.question
+
+    @expose(batch=True, sd_type="Django.IntegerField", sd_default=0,
+        sd_verbose_name="Poll votes",
+        sd_comment="The number of votes cast in the choice's poll")
+    def poll_votes(cls, choices):
+        poll_ids = set([c.poll_id for c in choices])
+        totals = dict(Choice.objects.filter(poll__in=poll_ids)
+            .values_list('poll').annotate(Sum('votes')))
+        return dict([(c.pk, totals.get(c.poll_id, 0)) for c in choices])
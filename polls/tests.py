@@ -1,7 +1,45 @@
 # coding: utf-8
+import base64
+import datetime
+import decimal
+import random
+from StringIO import StringIO
 
+from django.conf.urls.defaults import patterns, include
+from django.contrib.auth.models import User, Permission
+from django.core.cache import cache
+from django.core.cache.backends.dummy import DummyCache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.serializers import serialize
+from django.core.urlresolvers import RegexURLResolver
+from django.db.models import Q
+from django.http import Http404
+from django.utils import simplejson
+from django.utils.encoding import smart_str
 from django.test import Client, TestCase
-from polls.models import Poll
+from django.test.client import RequestFactory
+from polls.models import Poll, Choice
+
+from djangocore import api
+from djangocore.api import site
+from djangocore.api.auth.authenticators import DjangoAuthenticator
+from djangocore.api.auth.gateways import APITokenGateway, \
+    CookieDjangoUserGateway
+from djangocore.api.forms import FormResource
+from djangocore.api.models import indexes, versions
+from djangocore.api.models.dj import DjangoModelResource
+from djangocore.api.models.exposed import cached_method
+from djangocore.api.models.indexes import get_unindexed_queries
+from djangocore.api.models.objects import track_objects
+from djangocore.api.models.query_translator import translator, \
+    QueryCostError, QueryFieldError, QuerySyntaxError
+from djangocore.api.models.serializers import SerializationPlan
+from djangocore.api.models.versions import track_model, get_model_version
+from djangocore.api.sites import ResourceSite
+from djangocore.api.utils import reset_request_memo
+from djangocore.models import APIToken, token_cache
+from djangocore.serialization import emitter, iter_json_array
+from djangocore.utils import deconstruct
 
 from django.test.client import urlparse, urllib, settings, FakePayload, \
     encode_multipart, MULTIPART_CONTENT, CONTENT_TYPE_RE, BOUNDARY
@@ -40,6 +78,23 @@ def put(self, path, data={}, content_type=MULTIPART_CONTENT,
 # Patch the test Client so that PUT data is put in the proper location.
 Client.put = put
 
+class ResourceTestCase(TestCase):
+    """
+    Registers the API's resources before each test, so that tests that look
+    them up in the site's registry don't depend on the order they run in.
+
+    """
+    fixtures = ['testdata']
+
+    def setUp(self):
+        api.autodiscover()
+
+    def make_resource(self, model, **options):
+        """Returns a resource for the model that isn't registered with the site."""
+        options['model'] = model
+        return type('%sResource' % model.__name__, (DjangoModelResource,),
+            options)(site)
+
 class PollResourceTest(TestCase):
     fixtures = ['testdata']
 
@@ -98,3 +153,926 @@ class PollResourceTest(TestCase):
         self.assertEqual(response.content, '')
         self.assertEqual(response.status_code, 204)
         self.assertEqual(Poll.objects.count(), count - 1)
+
+class BatchTest(ResourceTestCase):
+    def batch(self, operations):
+        response = self.client.post('/api/models/polls/poll/batch/',
+            simplejson.dumps(operations), content_type='application/json')
+        return response, simplejson.loads(response.content)
+
+    def test_batch(self):
+        poll = Poll.objects.create(question='Shoes?', slug='shoes')
+        response, results = self.batch([
+            {'op': 'create', 'data': {'question': 'Hats?', 'slug': 'hats'}},
+            {'op': 'update', 'pk': 1,
+                'data': {'question': 'Socks?', 'slug': 'socks'}},
+            {'op': 'destroy', 'pk': poll.pk},
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([r['status'] for r in results], [200, 200, 204])
+        created = Poll.objects.get(slug='hats')
+        self.assertEqual(results[0]['record']['pk'], created.pk)
+        self.assertEqual(Poll.objects.get(pk=1).question, 'Socks?')
+        self.assertFalse(Poll.objects.filter(pk=poll.pk).exists())
+
+    def test_all_or_nothing(self):
+        count = Poll.objects.count()
+        response, results = self.batch([
+            {'op': 'create', 'data': {'question': 'Hats?', 'slug': 'hats'}},
+            {'op': 'create', 'data': {'question': 'No slug'}},
+            {'op': 'destroy', 'pk': 9999},
+            {'op': 'rename'},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([r['status'] for r in results], [424, 400, 404, 400])
+        self.assertTrue('slug' in results[1]['errors'])
+        self.assertEqual(Poll.objects.count(), count)
+
+    def test_same_object(self):
+        response, results = self.batch([
+            {'op': 'update', 'pk': 1,
+                'data': {'question': 'Socks?', 'slug': 'socks'}},
+            {'op': 'destroy', 'pk': 1},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([r['status'] for r in results], [424, 400])
+        self.assertNotEqual(Poll.objects.get(pk=1).question, 'Socks?')
+
+    def test_malformed(self):
+        response, results = self.batch({'op': 'create'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/api/models/polls/poll/batch/',
+            '[{"op": "destroy", "pk": 1}', content_type='application/json')
+        self.assertContains(response, 'malformed', status_code=400)
+        self.assertTrue(Poll.objects.filter(pk=1).exists())
+
+    def test_max_batch_size(self):
+        resource = site._registry['models/polls/poll/']
+        resource.max_batch_size = 1
+        try:
+            response, results = self.batch([{'op': 'destroy', 'pk': 1},
+                {'op': 'destroy', 'pk': 2}])
+        finally:
+            del resource.max_batch_size
+        self.assertEqual(response.status_code, 400)
+        self.assertTrue(Poll.objects.filter(pk=1).exists())
+
+    def test_admin_perms(self):
+        user = User.objects.create_user('voter', 'voter@example.com', 'vote')
+        user.user_permissions.add(Permission.objects.get(codename='add_poll'))
+        self.client.login(username='voter', password='vote')
+        resource = site._registry['models/polls/poll/']
+        authenticator = resource.authenticator
+        Authenticator = type('Authenticator', (DjangoAuthenticator,), {
+            'gateways': (CookieDjangoUserGateway,),
+            'admin_perms_required': True,
+        })
+        resource.authenticator = Authenticator(site, resource,
+            type('Auth', (), {}))
+        try:
+            response, results = self.batch([{'op': 'destroy', 'pk': 1}])
+            self.assertEqual(response.status_code, 403)
+            response, results = self.batch([{'op': 'create',
+                'data': {'question': 'Hats?', 'slug': 'hats'}}])
+            self.assertEqual(response.status_code, 200)
+        finally:
+            resource.authenticator = authenticator
+        self.assertTrue(Poll.objects.filter(pk=1).exists())
+
+    def test_iter_json_array(self):
+        doc = ' [1, 234567, {"a": ["b", null]}, "\xc3\xa9"] '
+        for chunk_size in (1, 3, 100):
+            self.assertEqual(list(iter_json_array(StringIO(doc), chunk_size)),
+                [1, 234567, {'a': ['b', None]}, u'\xe9'])
+        for doc in ('', '{}', '[1,', '[1 2]', '[1,]', '[1] 2'):
+            self.assertRaises(ValueError, list,
+                iter_json_array(StringIO(doc), 2))
+
+        # Large items are decoded in a logarithmic number of attempts.
+        stream = StringIO('["%s"]' % ('x' * 100000))
+        reads = []
+        def read(size):
+            reads.append(size)
+            return StringIO.read(stream, size)
+        stream.read = read
+        self.assertEqual(len(list(iter_json_array(stream, 100))), 1)
+        self.assertTrue(len(reads) < 20)
+
+class DestroyStrategyTest(ResourceTestCase):
+    def setUp(self):
+        super(DestroyStrategyTest, self).setUp()
+        self.resource = site._registry['models/polls/choice/']
+
+    def tearDown(self):
+        self.resource.destroy_strategy = 'collector'
+        self.resource.destroy_chunk_size = 500
+
+    def destroy(self, pks):
+        response = self.client.delete('/api/models/polls/choice/?%s' %
+            '&'.join(['pk=%s' % pk for pk in pks]))
+        self.assertEqual(response.status_code, 204)
+
+    def test_raw(self):
+        track_model(Choice)
+        version = get_model_version(Choice)
+        self.resource.destroy_strategy = 'raw'
+        pks = list(Choice.objects.values_list('pk', flat=True)[:2])
+        # One query to find the objects, and one to delete them.
+        self.assertNumQueries(2, self.destroy, pks)
+        self.assertFalse(Choice.objects.filter(pk__in=pks).exists())
+        self.assertNotEqual(get_model_version(Choice), version)
+
+    def test_chunked(self):
+        self.resource.destroy_strategy = 'chunked'
+        self.resource.destroy_chunk_size = 2
+        pks = list(Choice.objects.values_list('pk', flat=True))
+        self.destroy(pks)
+        self.assertEqual(Choice.objects.count(), 0)
+
+    def test_raw_needs_independent_model(self):
+        self.assertRaises(ImproperlyConfigured, self.make_resource, Poll,
+            destroy_strategy='raw')
+
+class RelatedPlanningTest(ResourceTestCase):
+    def setUp(self):
+        super(RelatedPlanningTest, self).setUp()
+        self.resource = site._registry['models/polls/choice/']
+
+    def test_inferred_paths(self):
+        self.assertEqual(self.resource.related_paths[0], ['poll'])
+
+    def test_page_query_count(self):
+        poll = Poll.objects.get(pk=1)
+        for i in range(500 - Choice.objects.count()):
+            Choice.objects.create(poll=poll, answer='Answer %d' % i)
+        # One query for the page, and one for the poll_votes batch method.
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/models/polls/choice/list/',
+                {'limit': 500})
+        records = simplejson.loads(response.content)
+        self.assertEqual(len(records), 500)
+        self.assertEqual(records[0]['fields']['question'], poll.question)
+
+    def test_unknown_dependency(self):
+        self.assertRaises(ImproperlyConfigured, self.make_resource, Choice,
+            select_related=('poll__owner',))
+
+class ColumnPruningTest(ResourceTestCase):
+    def test_rows(self):
+        Poll.objects.create(question='Shoes?', slug='shoes')
+        resource = self.make_resource(Poll, fields=('slug',))
+        self.assertEqual(resource.serialization_plan.columns, ['id', 'slug'])
+        qs = Poll.objects.order_by('pk')[1:2]
+        self.assertEqual(list(resource.serialize_query_set(qs)),
+            resource.serialize_models(qs))
+
+    def test_deferred_instances(self):
+        resource = self.make_resource(Choice, fields=('votes',))
+        self.assertEqual(resource.only_fields, ['id', 'votes', 'poll'])
+        qs = resource.get_query_set(None)
+        # One query for the objects, and one for the poll_votes batch method.
+        with self.assertNumQueries(2):
+            records = list(resource.serialize_query_set(qs))
+        self.assertEqual(records, resource.serialize_models(qs))
+        self.assertFalse('answer' in records[0]['fields'])
+
+class ExposedCacheTest(ResourceTestCase):
+    def setUp(self):
+        super(ExposedCacheTest, self).setUp()
+        cache.clear()
+        self.calls = 0
+
+    def cached(self, scope):
+        def method(obj):
+            self.calls += 1
+            return obj.votes
+        method.cache = scope
+        return cached_method(Choice, 'votes_%s' % scope, method)
+
+    def test_request(self):
+        method, choice = self.cached('request'), Choice.objects.get(pk=1)
+        reset_request_memo()
+        self.assertEqual([method(choice), method(choice)], [0, 0])
+        self.assertEqual(self.calls, 1)
+        reset_request_memo()
+        method(choice)
+        self.assertEqual(self.calls, 2)
+
+    def test_ttl(self):
+        method, choice = self.cached('ttl:60'), Choice.objects.get(pk=1)
+        method(choice)
+        reset_request_memo()
+        method(choice)
+        self.assertEqual(self.calls, 1)
+
+    def test_version(self):
+        method, choice = self.cached('version'), Choice.objects.get(pk=1)
+        method(choice)
+        reset_request_memo()
+        method(choice)
+        self.assertEqual(self.calls, 1)
+        choice.votes = 5
+        choice.save()
+        reset_request_memo()
+        self.assertEqual(method(choice), 5)
+        self.assertEqual(self.calls, 2)
+
+    def test_unknown_scope(self):
+        self.assertRaises(ImproperlyConfigured, self.cached, 'forever')
+
+class DispatcherTest(ResourceTestCase):
+    urls = 'polls.tests'
+
+    def test_dispatch(self):
+        response = self.client.get('/api/models/polls/poll/list/')
+        self.assertContains(response, 'What color are your socks?')
+        response = self.client.get('/api/models/polls/poll/?pk=1')
+        self.assertContains(response, 'What color are your socks?')
+        response = self.client.post('/api/models/polls/poll/list/')
+        self.assertEqual(response.status_code, 405)
+        self.assertRaises(Http404, site.resolve, 'models/polls/nothing/list/')
+
+    def test_matches_resolver(self):
+        """Checks the dispatcher against Django's resolver."""
+        site = ResourceSite()
+        for i in range(500):
+            site.register(type('Form%d' % i, (FormResource,), {}))
+        class URLConf:
+            urlpatterns = site.get_urls()
+        resolver = RegexURLResolver(r'^', URLConf)
+
+        for path in ['forms/form%d/form/' % i for i in (0, 250, 499)]:
+            self.assertEqual(resolver.resolve(path).kwargs,
+                site.resolve(path)[1])
+
+class AuthenticatorTest(ResourceTestCase):
+    def setUp(self):
+        super(AuthenticatorTest, self).setUp()
+        self.user = User.objects.create_user('voter', 'voter@example.com')
+        self.user.user_permissions.add(
+            Permission.objects.get(codename='change_poll'))
+        self.resource = site._registry['models/polls/poll/']
+        Authenticator = type('Authenticator', (DjangoAuthenticator,), {
+            'gateways': (CookieDjangoUserGateway,),
+            'admin_perms_required': True,
+            'perms_cache_timeout': 60,
+        })
+        self.auth = Authenticator(site, self.resource, type('Auth', (), {}))
+        self.factory = RequestFactory()
+
+    def request(self, method='get'):
+        request = getattr(self.factory, method)('/api/models/polls/poll/')
+        request.user = User.objects.get(pk=self.user.pk)
+        request.session = self.session
+        return request
+
+    def test_compiled_tests(self):
+        self.assertEqual(self.auth.tests, [self.auth.admin_perms_check])
+
+    def test_admin_perms(self):
+        self.session = {}
+        handler = self.resource.list
+        request = self.request()
+        self.assertTrue(self.auth.is_authenticated(request, handler))
+        self.assertFalse(self.auth.is_authenticated(self.request('post'),
+            handler))
+
+        # The same request doesn't check the same permission twice...
+        self.assertNumQueries(0, self.auth.is_authenticated, request, handler)
+        # ...and neither do later requests in the same session.
+        reset_request_memo()
+        request = self.request()
+        self.assertNumQueries(0, self.auth.is_authenticated, request, handler)
+
+    def test_session_cache_per_user(self):
+        self.session = {}
+        handler = self.resource.list
+        self.assertTrue(self.auth.is_authenticated(self.request(), handler))
+        # Another user logs in through the same session.
+        reset_request_memo()
+        request = self.request()
+        request.user = User.objects.create_user('other', 'other@example.com')
+        self.assertFalse(self.auth.is_authenticated(request, handler))
+
+class TokenGatewayTest(ResourceTestCase):
+    def setUp(self):
+        super(TokenGatewayTest, self).setUp()
+        token_cache.clear()
+        self.gateway = APITokenGateway(None, None, None)
+        self.user = User.objects.create_user('voter', 'voter@example.com')
+        self.token, self.key = APIToken.objects.create_token(self.user)
+        self.factory = RequestFactory()
+
+    def get_user(self, key):
+        return self.gateway.get_user(self.factory.get('/', {'token': key}))
+
+    def test_cached_lookup(self):
+        self.assertEqual(self.get_user(self.key), self.user)
+        self.assertNumQueries(0, self.get_user, self.key)
+        request = self.factory.get('/', HTTP_AUTHORIZATION='Token %s' %
+            self.key)
+        self.assertEqual(self.gateway.get_user(request), self.user)
+        self.assertEqual(self.get_user('wrong'), None)
+
+    def test_revocation(self):
+        self.get_user(self.key)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.get_user(self.key), None)
+        self.user.is_active = True
+        self.user.save()
+        self.assertEqual(self.get_user(self.key), self.user)
+        self.token.delete()
+        self.assertEqual(self.get_user(self.key), None)
+
+    def test_token_parameter(self):
+        Auth = type('Auth', (), {'gateways': (APITokenGateway,)})
+        resource = self.make_resource(Choice, Auth=Auth)
+        ops = dict(resource.get_routes())
+        # The token isn't mistaken for a lookup.
+        for path in ('list/', 'length/'):
+            request = self.factory.get('/', {'token': self.key})
+            response = resource.mapper(request, **ops[path])
+            self.assertEqual(response.status_code, 200)
+
+    def test_unrelated_saves_keep_cache(self):
+        self.get_user(self.key)
+        # Logging in saves the user on every login.
+        self.user.last_login = datetime.datetime.now()
+        self.user.save()
+        self.assertNumQueries(0, self.get_user, self.key)
+
+class RequestDataTest(ResourceTestCase):
+    def test_media_type(self):
+        response = self.client.post('/api/models/polls/poll/',
+            '{"question": "Hats?", "slug": "hats"}',
+            content_type='application/json; charset=ISO-8859-1')
+        self.assertContains(response, 'Hats?')
+
+    def test_lazy_parsing(self):
+        # The body is never parsed if the handler bails out first...
+        response = self.client.put('/api/models/polls/poll/', '{',
+            content_type='application/json')
+        self.assertContains(response, 'single pk', status_code=400)
+        # ...but malformed data is still reported.
+        response = self.client.put('/api/models/polls/poll/?pk=1', '{',
+            content_type='application/json')
+        self.assertContains(response, 'malformed', status_code=400)
+
+    def test_put_form_data(self):
+        response = self.client.put('/api/models/polls/poll/?pk=1',
+            'question=Hats%3F&slug=hats',
+            content_type='application/x-www-form-urlencoded')
+        self.assertContains(response, 'Hats?')
+        self.assertEqual(Poll.objects.get(pk=1).slug, 'hats')
+
+    def test_max_body_size(self):
+        resource = site._registry['models/polls/poll/']
+        resource.max_body_size = 16
+        try:
+            response = self.client.post('/api/models/polls/poll/',
+                '{"question": "Hats?", "slug": "hats"}',
+                content_type='application/json')
+        finally:
+            del resource.max_body_size
+        self.assertContains(response, '16 bytes', status_code=413)
+        self.assertFalse(Poll.objects.filter(slug='hats').exists())
+
+class StreamingListTest(ResourceTestCase):
+    def setUp(self):
+        super(StreamingListTest, self).setUp()
+        self.resource = site._registry['models/polls/choice/']
+        self.resource.stream_chunk_size = 2
+
+    def tearDown(self):
+        self.resource.stream_chunk_size = 0
+
+    def test_streamed_list_matches(self):
+        response = self.client.get('/api/models/polls/choice/list/')
+        self.assertEqual(response.status_code, 200)
+        data = simplejson.loads(response.content)
+        self.assertEqual(data,
+            self.resource.serialize_models(Choice.objects.all()))
+
+    def test_streamed_empty_list(self):
+        response = self.client.get('/api/models/polls/choice/list/?offset=100')
+        self.assertEqual(response.content, '[]')
+
+    def test_streamed_matches_buffered(self):
+        path = '/api/models/polls/choice/list/'
+        for query in ('', '?pretty=1'):
+            streamed = self.client.get(path + query).content
+            self.resource.stream_chunk_size = 0
+            buffered = self.client.get(path + query).content
+            self.resource.stream_chunk_size = 2
+            self.assertEqual(streamed, buffered)
+
+        emitter.set_encoder('json', lambda data: simplejson.dumps(data,
+            sort_keys=True, separators=(',', ':')))
+        try:
+            streamed = self.client.get(path).content
+            self.resource.stream_chunk_size = 0
+            buffered = self.client.get(path).content
+        finally:
+            emitter.set_encoder('json', None)
+        self.assertEqual(streamed, buffered)
+
+    def test_serialized_inside_view(self):
+        # Batch methods query the database once per object.
+        self.resource.serialization_plan.batch_size = 1
+        try:
+            response = self.client.get('/api/models/polls/choice/list/')
+        finally:
+            del self.resource.serialization_plan.batch_size
+        # Nothing is left to read from the database once the view returns.
+        with self.assertNumQueries(0):
+            response.content
+
+class CursorListTest(ResourceTestCase):
+    def get_page(self, cursor='', **params):
+        params['cursor'] = cursor
+        response = self.client.get('/api/models/polls/choice/list/', params)
+        self.assertEqual(response.status_code, 200)
+        return simplejson.loads(response.content)
+
+    def test_cursor_pages(self):
+        expected = list(Choice.objects.order_by('-answer', 'pk')
+            .values_list('pk', flat=True))
+        seen, cursor = [], ''
+        while cursor is not None:
+            page = self.get_page(cursor, ordering='-answer', limit=2)
+            seen.extend([r['pk'] for r in page['records']])
+            cursor = page['next']
+        self.assertEqual(seen, expected)
+
+    def test_bad_cursor(self):
+        for cursor in ('garbage', base64.urlsafe_b64encode('["abc"]'),
+          base64.urlsafe_b64encode('[null]')):
+            response = self.client.get('/api/models/polls/choice/list/',
+                {'cursor': cursor})
+            self.assertEqual(response.status_code, 400)
+
+    def test_foreign_key_cursor(self):
+        Choice.objects.create(poll=Poll.objects.create(question='A hat?',
+            slug='hats'), answer='Yes')
+        resource = site._registry['models/polls/choice/']
+        # The pages follow the keys, not the related model's ordering.
+        Poll._meta.ordering = ['question']
+        try:
+            seen, cursor = [], ''
+            while cursor is not None:
+                page = resource.list_by_cursor(Choice.objects.all(),
+                    ['poll'], cursor, 2).content
+                seen.extend([r['pk'] for r in page['records']])
+                cursor = page['next']
+        finally:
+            Poll._meta.ordering = []
+        self.assertEqual(seen, list(Choice.objects.order_by('poll__pk', 'pk')
+            .values_list('pk', flat=True)))
+
+    def test_datetime_cursor(self):
+        resource = self.make_resource(APIToken)
+        user = User.objects.create_user('voter', 'voter@example.com')
+        created = datetime.datetime(2020, 1, 1, 12, 0, 0, 500000)
+        for i in range(3):
+            token, key = APIToken.objects.create_token(user)
+            APIToken.objects.filter(pk=token.pk).update(
+                created=created + datetime.timedelta(microseconds=i))
+
+        seen, cursor = [], ''
+        while cursor is not None:
+            page = resource.list_by_cursor(APIToken.objects.all(),
+                ['created'], cursor, 1).content
+            seen.extend([r['pk'] for r in page['records']])
+            cursor = page['next']
+        self.assertEqual(seen, list(APIToken.objects.order_by('created')
+            .values_list('pk', flat=True)))
+
+        # Databases disagree on where NULLs sort.
+        response = resource.list_by_cursor(APIToken.objects.all(),
+            ['expires'], '', 1)
+        self.assertEqual(response.ops['status'], 400)
+
+class LengthTest(ResourceTestCase):
+    def setUp(self):
+        super(LengthTest, self).setUp()
+        self.resource = site._registry['models/polls/choice/']
+        self.resource.count_cache_timeout = 60
+        track_model(Choice)
+
+    def tearDown(self):
+        self.resource.count_cache_timeout = 0
+
+    def test_max_count(self):
+        count = Choice.objects.count()
+        response = self.client.get('/api/models/polls/choice/length/?max=2')
+        self.assertEqual(response.content, '2')
+        response = self.client.get('/api/models/polls/choice/length/?max=100')
+        self.assertEqual(response.content, str(count))
+        response = self.client.get('/api/models/polls/choice/length/?max=-1')
+        self.assertEqual(response.status_code, 400)
+
+    def test_count_cache_invalidation(self):
+        count = Choice.objects.count()
+        response = self.client.get('/api/models/polls/choice/length/')
+        self.assertEqual(response.content, str(count))
+        self.assertNumQueries(0, self.client.get,
+            '/api/models/polls/choice/length/')
+        Choice.objects.create(poll=Poll.objects.get(pk=1), answer='Green')
+        response = self.client.get('/api/models/polls/choice/length/')
+        self.assertEqual(response.content, str(count + 1))
+
+class ObjectCacheTest(ResourceTestCase):
+    def setUp(self):
+        super(ObjectCacheTest, self).setUp()
+        cache.clear()
+        self.resource = site._registry['models/polls/choice/']
+        self.resource.object_cache_timeout = 60
+        track_objects(Choice, self.resource.serialization_plan.signature,
+            ['poll'])
+
+    def tearDown(self):
+        self.resource.object_cache_timeout = 0
+
+    def get_pks(self, pks):
+        response = self.client.get('/api/models/polls/choice/', {'pk': pks})
+        self.assertEqual(response.status_code, 200)
+        return simplejson.loads(response.content)
+
+    def test_request_order(self):
+        pks = list(Choice.objects.values_list('pk', flat=True)[:3])
+        pks.reverse()
+        records = self.get_pks(pks + [pks[0], 9999])
+        self.assertEqual([r['pk'] for r in records], pks)
+
+    def test_only_misses_hit_the_database(self):
+        pks = list(Choice.objects.values_list('pk', flat=True)[:3])
+        self.get_pks(pks[:2])
+        # One query to check which of the objects the request may see...
+        self.assertNumQueries(1, self.get_pks, pks[:2])
+        # ...and one for the missing object, and one for its poll_votes.
+        self.assertNumQueries(3, self.get_pks, pks)
+
+    def test_hidden_objects(self):
+        pks = list(Choice.objects.values_list('pk', flat=True)[:2])
+        self.get_pks(pks)
+        # Resources that filter their objects per request share the cache,
+        # but never see the objects they hide.
+        def get_query_set(self, request):
+            return Choice.objects.exclude(pk=pks[0])
+        resource = self.make_resource(Choice, object_cache_timeout=60,
+            get_query_set=get_query_set)
+        request = RequestFactory().get('/', {'pk': pks})
+        records = resource.show(request).content
+        self.assertEqual([r['pk'] for r in records], pks[1:])
+
+    def test_invalidation(self):
+        choice = Choice.objects.all()[0]
+        pk = choice.pk
+        self.get_pks([pk])
+        choice.answer = 'Turquoise'
+        choice.save()
+        self.assertEqual(self.get_pks([pk])[0]['fields']['answer'],
+            'Turquoise')
+        choice.delete()
+        self.assertEqual(self.get_pks([pk]), [])
+
+    def test_dependency_invalidation(self):
+        choice = Choice.objects.all()[0]
+        self.get_pks([choice.pk])
+        # The question exposed by choices is read from their poll.
+        poll = choice.poll
+        poll.question = 'Which hats?'
+        poll.save()
+        self.assertEqual(self.get_pks([choice.pk])[0]['fields']['question'],
+            'Which hats?')
+
+    def test_malformed_pk(self):
+        response = self.client.get('/api/models/polls/choice/?pk=x')
+        self.assertEqual(response.status_code, 400)
+
+class ETagTest(ResourceTestCase):
+    def setUp(self):
+        super(ETagTest, self).setUp()
+        self.resource = site._registry['models/polls/choice/']
+        self.resource.use_etags = True
+        track_model(Choice)
+
+    def tearDown(self):
+        self.resource.use_etags = False
+
+    def test_not_modified(self):
+        url = '/api/models/polls/choice/list/'
+        response = self.client.get(url, {'ordering': 'answer'})
+        etag = response['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(url, {'ordering': 'answer'},
+                HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, '')
+
+        # Different arguments have a different ETag.
+        response = self.client.get(url, {'ordering': '-answer'},
+            HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_invalidation(self):
+        url = '/api/models/polls/choice/length/'
+        etag = self.client.get(url)['ETag']
+        Choice.objects.create(poll=Poll.objects.get(pk=1), answer='Green')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_without_versions(self):
+        version_cache = versions.cache
+        # Caches that don't keep the version counter can't validate anything.
+        versions.cache = DummyCache('', {})
+        try:
+            response = self.client.get('/api/models/polls/choice/length/')
+        finally:
+            versions.cache = version_cache
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('ETag'))
+
+    def test_errors_have_no_etag(self):
+        response = self.client.get('/api/models/polls/choice/')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(response.has_header('ETag'))
+
+class PageTest(ResourceTestCase):
+    def test_page(self):
+        response = self.client.get('/api/models/polls/choice/page/',
+            {'ordering': 'answer', 'limit': 2, 'conditions': 'votes = 0'})
+        self.assertEqual(response.status_code, 200)
+        data = simplejson.loads(response.content)
+        qs = Choice.objects.filter(votes=0).order_by('answer')
+        self.assertEqual(data['length'], qs.count())
+        self.assertEqual([r['pk'] for r in data['records']],
+            [c.pk for c in qs[:2]])
+
+    def test_bad_ordering(self):
+        response = self.client.get('/api/models/polls/choice/page/',
+            {'ordering': 'poll__question'})
+        self.assertEqual(response.status_code, 400)
+
+class TranslatorTest(ResourceTestCase):
+    def setUp(self):
+        super(TranslatorTest, self).setUp()
+        self.translator = translator(Choice)
+
+    def filter(self, conditions, parameters={}):
+        q = self.translator.parse(conditions, parameters)
+        return list(Choice.objects.filter(q).order_by('pk'))
+
+    def test_template_cache(self):
+        conditions = u"answer = {a} OR answer = {b}"
+        red = self.filter(conditions, {'a': 'Red', 'b': 'Red'})
+        self.assertNotEqual(self.translator.templates.get(conditions), None)
+        both = self.filter(conditions, {'a': 'Red', 'b': 'Blue'})
+        self.assertEqual([c.answer for c in red], ['Red'])
+        self.assertEqual(sorted([c.answer for c in both]), ['Blue', 'Red'])
+
+    def test_precedence_and_grouping(self):
+        self.assertEqual([c.answer for c in self.filter(
+            u"answer = 'Blue' OR answer = 'Red' AND votes > 0")], ['Blue'])
+        self.assertEqual(self.filter(
+            u"(answer = 'Blue' OR answer = 'Red') AND votes > 0"), [])
+        self.assertEqual([c.answer for c in self.filter(
+            u"NOT (answer != 'Blue') AND NOT NOT votes = 0")], ['Blue'])
+
+    def test_syntax_errors(self):
+        for conditions in (u"answer =", u"answer = 'Blue' AND", u"(votes = 1",
+          u"= 1", u"answer LIKE 'x'", u"votes = 1 votes = 2", u"#"):
+            self.assertRaises(QuerySyntaxError, self.translator.parse,
+                conditions)
+
+    def test_fuzz(self):
+        pieces = [u"answer", u"poll.question", u"votes", u"=", u"!=", u"<",
+            u"AND", u"OR", u"NOT", u"(", u")", u",", u"'x'", u'"y', u"1",
+            u"{p}", u"CONTAINS", u"NOT IN", u"MATCHES", u"\\", u"'", u"@"]
+        rand = random.Random(42)
+        for i in range(500):
+            conditions = u" ".join([rand.choice(pieces)
+                for j in range(rand.randint(1, 12))])
+            try:
+                q = self.translator.parse(conditions, {'p': '2'})
+            except QuerySyntaxError:
+                continue
+            self.assertTrue(isinstance(q, Q))
+
+    def test_adversarial_input(self):
+        # Inputs that made the old regex tokenizer backtrack badly, or that
+        # would recurse deeply in a naive parser.
+        self.translator.parse(u" AND ".join([u"votes = 1"] * 2000))
+        self.translator.parse(u"NOT " * 5000 + u"votes = 1")
+        for conditions in (u"answer = 'x" + u"'x" * 5000,
+          u"(" * 5000 + u"votes = 1" + u")" * 5000,
+          u"votes = 1 AND " * 5000):
+            self.assertRaises(QuerySyntaxError, self.translator.parse,
+                conditions)
+
+    def test_model_coercion(self):
+        self.assertEqual(self.filter(u"votes > {v}", {'v': '0'}), [])
+        q = self.translator.parse(u"votes = '1' AND poll.slug = 2")
+        self.assertEqual(q.children, [('votes__exact', 1),
+            ('poll__slug__exact', u'2')])
+        q = self.translator.parse(u"poll IN {p}", {'p': '(1, 2)'})
+        self.assertEqual(q.children, [('poll__in', [1, 2])])
+        q = self.translator.parse(u"votes IN ({a}, {b})", {'a': '0', 'b': '2'})
+        self.assertEqual(q.children, [('votes__in', [0, 2])])
+        self.assertEqual(len(Choice.objects.filter(q)),
+            Choice.objects.filter(votes__in=[0, 2]).count())
+        self.assertEqual(len(self.filter(u"poll.question CONTAINS 'socks'")),
+            Choice.objects.filter(poll__question__contains='socks').count())
+        for conditions in (u"color = 'red'", u"poll.color = 1",
+          u"votes.count = 1", u"votes = 'many'"):
+            self.assertRaises(QueryFieldError, self.translator.parse,
+                conditions)
+
+    def test_query_cost(self):
+        # An indexed equality lookup through a foreign key is cheap...
+        self.assertEqual(self.translator.cost(
+            self.translator.compile(u"poll = 1")), 1)
+        # ...while regular expressions across a join on an unindexed column
+        # are expensive.
+        self.assertEqual(self.translator.cost(
+            self.translator.compile(u"poll.question MATCHES 'x'")), 48)
+        self.translator.max_cost = 10
+        self.translator.parse(u"poll = 1 OR poll.slug = 'x'")
+        self.assertRaises(QueryCostError, self.translator.parse,
+            u"answer CONTAINS 'a' OR answer CONTAINS 'b'")
+        self.assertEqual(self.translator.cost(self.translator.compile_lookups(
+            {'poll': 1, 'poll__question__regex': 'x'})), 49)
+
+    def test_literals(self):
+        self.assertEqual([c.answer for c in self.filter(u"answer = 'Blue'")],
+            ['Blue'])
+        self.assertEqual(self.filter(u"votes > 0"), [])
+
+    def test_expensive_conditions(self):
+        resource = site._registry['models/polls/choice/']
+        resource.translator.max_cost = 5
+        try:
+            response = self.client.get('/api/models/polls/choice/page/',
+                {'conditions': "answer MATCHES 'x'"})
+            lookups = self.client.get('/api/models/polls/choice/page/',
+                {'answer__regex': 'x'})
+            insensitive = self.client.get('/api/models/polls/choice/page/',
+                {'answer__iregex': 'x'})
+            length = self.client.get('/api/models/polls/choice/length/',
+                {'answer__regex': 'x'})
+            cheap = self.client.get('/api/models/polls/choice/page/',
+                {'poll': 1})
+        finally:
+            resource.translator.max_cost = None
+        self.assertEqual(response.status_code, 400)
+        self.assertContains(lookups, 'too expensive', status_code=400)
+        self.assertContains(insensitive, 'too expensive', status_code=400)
+        self.assertContains(length, 'too expensive', status_code=400)
+        self.assertEqual(cheap.status_code, 200)
+
+    def test_unknown_field(self):
+        response = self.client.get('/api/models/polls/choice/page/',
+            {'conditions': "color = 'red'"})
+        self.assertEqual(response.status_code, 400)
+
+class IndexPolicyTest(ResourceTestCase):
+    def setUp(self):
+        super(IndexPolicyTest, self).setUp()
+        cache.clear()
+        self.resource = site._registry['models/polls/choice/']
+
+    def tearDown(self):
+        self.resource.unindexed_query_policy = 'allow'
+
+    def test_indexed_fields(self):
+        self.assertEqual(self.resource.indexed_fields, ['id', 'poll'])
+
+    def test_warn(self):
+        self.resource.unindexed_query_policy = 'warn'
+        response = self.client.get('/api/models/polls/choice/list/',
+            {'ordering': 'votes', 'conditions': "poll = 1 AND answer = 'x'"})
+        self.assertEqual(response.status_code, 200)
+        self.client.get('/api/models/polls/choice/list/', {'ordering': 'pk'})
+        # Queries which only differ in their values have the same shape.
+        self.client.get('/api/models/polls/choice/list/',
+            {'ordering': 'votes', 'conditions': "poll = 2 AND answer = 'y'"})
+        self.assertEqual(get_unindexed_queries(self.resource),
+            [(((u'votes',), u"(poll exact ? AND answer exact ?)",
+            (u'votes', 'answer')), 2)])
+
+    def test_max_shapes(self):
+        self.resource.unindexed_query_policy = 'warn'
+        max_shapes = indexes.max_shapes
+        indexes.max_shapes = 1
+        try:
+            for conditions in ("answer = 'x'", "votes = 1", "answer = 'y'"):
+                self.client.get('/api/models/polls/choice/list/',
+                    {'conditions': conditions})
+        finally:
+            indexes.max_shapes = max_shapes
+        self.assertEqual(indexes.get_unindexed_queries(self.resource),
+            [(((), u"answer exact ?", ('answer',)), 2)])
+
+    def test_reject(self):
+        self.resource.unindexed_query_policy = 'reject'
+        response = self.client.get('/api/models/polls/choice/list/',
+            {'conditions': "poll = 1"})
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get('/api/models/polls/choice/list/',
+            {'conditions': "answer = 'x'"})
+        self.assertEqual(response.status_code, 400)
+
+class JSONEmitterTest(ResourceTestCase):
+    def test_compact_by_default(self):
+        # Only the payload sizes are compared; encode times are too noisy to
+        # assert on in a unit test.
+        compact = self.client.get('/api/models/polls/choice/list/')
+        pretty = self.client.get('/api/models/polls/choice/list/?pretty=1')
+        self.assertFalse('\n' in compact.content)
+        self.assertTrue('\n' in pretty.content)
+        self.assertTrue(len(compact.content) < len(pretty.content))
+
+    def test_encoder_hook(self):
+        calls = []
+        def encoder(data):
+            calls.append(data)
+            return '"encoded"'
+        emitter.set_encoder('json', encoder)
+        try:
+            response = self.client.get('/api/models/polls/choice/list/')
+            pretty = self.client.get('/api/models/polls/choice/list/?pretty=1')
+        finally:
+            emitter.set_encoder('json', None)
+        self.assertEqual(response.content, '"encoded"')
+        self.assertEqual(len(calls), 1)
+        self.assertNotEqual(pretty.content, '"encoded"')
+
+class DeconstructTest(TestCase):
+    def test_dispatch(self):
+        now = datetime.datetime.now()
+        data = {'a': (1, 2L, 1.5, None, True), 'b': [decimal.Decimal('1.10')],
+            'c': 'bytes', 'd': now, 'e': lambda: 1}
+        self.assertEqual(deconstruct(data), {'a': [1, 2L, 1.5, None, True],
+            'b': ['1.10'], 'c': u'bytes', 'd': now, 'e': None})
+
+class SerializationPlanTest(ResourceTestCase):
+    def test_matches_django_serializer(self):
+        for model in (Poll, Choice):
+            qs = model.objects.all()
+            plan = SerializationPlan(model)
+            records = plan.serialize_many(qs)
+            # Django's serializer doesn't know about exposed methods.
+            for record in records:
+                for name, method in plan.exposed:
+                    del record['fields'][name]
+            self.assertEqual(records, serialize('python', qs))
+
+    def test_fields_whitelist(self):
+        qs = Choice.objects.all()
+        plan = SerializationPlan(Choice, fields=('poll', 'answer'))
+        self.assertEqual(plan.fk_attnames, ['poll_id'])
+        expected = serialize('python', qs, fields=('poll', 'answer'))
+        for record, choice in zip(expected, qs):
+            record['fields']['question'] = choice.question()
+            record['fields']['poll_votes'] = choice.poll_votes()
+        self.assertEqual(plan.serialize_many(qs), expected)
+
+    def test_batch_methods(self):
+        Choice.objects.filter(pk=1).update(votes=3)
+        Choice.objects.create(poll=Poll.objects.create(question='Hats?',
+            slug='hats'), answer='Yes', votes=2)
+        qs = Choice.objects.select_related('poll').order_by('pk')
+        plan = SerializationPlan(Choice)
+        self.assertEqual(plan.batched[0][0], 'poll_votes')
+        # The batch function is called once for the whole page...
+        with self.assertNumQueries(2):
+            batched = plan.serialize_many(qs)
+        # ...and agrees with calling the method on each object.
+        self.assertEqual(batched, [plan.serialize(c) for c in qs])
+        self.assertEqual([r['fields']['poll_votes'] for r in batched],
+            [3] * (len(batched) - 1) + [2])
+        plan.batch_size = 2
+        self.assertEqual(list(plan.iter_serialize(qs)), batched)
+
+    def test_without_plan(self):
+        resource = self.make_resource(Choice, serialization_plan_class=None)
+        ops = dict(resource.get_routes())
+        expected = resource.serialize_models(Choice.objects.order_by('pk'))
+        for path, params in (('list/', {'ordering': 'pk'}),
+          ('page/', {'ordering': 'pk'}), ('list/', {'cursor': ''})):
+            request = RequestFactory().get('/', params)
+            response = resource.mapper(request, **ops[path])
+            self.assertEqual(response.status_code, 200)
+            data = simplejson.loads(response.content)
+            if isinstance(data, dict):
+                data = data['records']
+            self.assertEqual(data, simplejson.loads(simplejson.dumps(
+                deconstruct(expected))))
+
+# Mounts the API with the site's dispatcher, for the DispatcherTest.
+urlpatterns = patterns('',
+    (r'^api/', include(site.dispatch_urls)),
+)